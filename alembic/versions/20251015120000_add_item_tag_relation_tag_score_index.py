@@ -0,0 +1,30 @@
+"""Add tag/score index to item tag relations
+
+Revision ID: 20251015120000
+Revises: 5b1e18992b39
+Create Date: 2025-10-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20251015120000'
+down_revision: Union[str, None] = '5b1e18992b39'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Covers filtering relations by tag and minimum score, as in the digest queries
+    op.create_index(
+        'idx_item_tag_relation_tag_scores',
+        'item_tag_relations',
+        ['tag_id', 'relation_value', 'item_id']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_item_tag_relation_tag_scores', table_name='item_tag_relations')
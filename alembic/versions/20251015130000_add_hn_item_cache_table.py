@@ -0,0 +1,35 @@
+"""Add Hacker News item cache table
+
+Revision ID: 20251015130000
+Revises: 20251015120000
+Create Date: 2025-10-15 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20251015130000'
+down_revision: Union[str, None] = '20251015120000'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'hn_item_cache',
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('item_id')
+    )
+    op.create_index('idx_hn_item_cache_expires_at', 'hn_item_cache', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_hn_item_cache_expires_at', table_name='hn_item_cache')
+    op.drop_table('hn_item_cache')
@@ -15,6 +15,9 @@ from googleapiclient.errors import HttpError
 # If modifying these scopes, delete the token.json file
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Gmail accepts up to 100 calls per batch request, but larger batches get rate limited
+MAX_BATCH_SIZE = 50
+
 
 class GmailDigestProvider:
     """Provider for fetching digest emails from Gmail API."""
@@ -111,7 +114,51 @@ class GmailDigestProvider:
             print(f'Error fetching message {message_id}: {error}')
             return None
 
-    def get_message_content(self, message: Dict[str, Any]) -> Dict[str, str]:
+    def get_messages_details_batch(
+        self,
+        message_ids: List[str]
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get full details of several email messages using batch HTTP requests.
+
+        Args:
+            message_ids: Gmail message IDs
+
+        Returns:
+            Message details keyed by message ID; None for messages that failed to load
+        """
+        if not self.service:
+            self.authenticate()
+
+        details = {}
+
+        def on_response(request_id: str, response: Dict[str, Any], exception: HttpError) -> None:
+            if exception is not None:
+                print(f'Error fetching message {request_id}: {exception}')
+                details[request_id] = None
+            else:
+                details[request_id] = response
+
+        for start in range(0, len(message_ids), MAX_BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for message_id in message_ids[start:start + MAX_BATCH_SIZE]:
+                batch.add(
+                    self.service.users().messages().get(
+                        userId='me',
+                        id=message_id,
+                        format='full'
+                    ),
+                    request_id=message_id
+                )
+            try:
+                batch.execute()
+            except HttpError as error:
+                print(f'Error fetching message batch: {error}')
+
+        return {message_id: details.get(message_id) for message_id in message_ids}
+
+    @staticmethod
+    def get_message_content(message: Dict[str, Any]) -> Dict[str, str]:
         """
         Extract text and HTML content from a message.
 
@@ -150,8 +197,8 @@ class GmailDigestProvider:
 
         return content
 
+    @staticmethod
     def extract_links_from_content(
-        self,
         content: Dict[str, str]
     ) -> List[Dict[str, str]]:
         """
@@ -183,8 +230,8 @@ class GmailDigestProvider:
 
         return links
 
+    @staticmethod
     def parse_message_metadata(
-        self,
         message: Dict[str, Any]
     ) -> Dict[str, Any]:
         """
@@ -1 +1,8 @@
+import ssl
+
+import certifi
+
 API_URL = "https://hacker-news.firebaseio.com"
+
+# Parsing the CA bundle is slow, so build the SSL context once and share it
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
@@ -0,0 +1,115 @@
+"""
+Database-backed cache of Hacker News API item responses.
+
+Only terminal items (deleted or dead) are cached, since their content and replies no longer
+change. A dead item that gets vouched for is still served from the cache until its entry
+expires, so callers that need the current state pass use_cache=False.
+"""
+
+import asyncio
+import logging
+from datetime import datetime as dtime, timedelta, UTC
+from typing import Any, Dict
+
+import aiohttp
+import orjson
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from octopus.data_providers.hacker_news import API_URL
+from octopus.db.models.hacker_news import HNItemCache
+
+logger = logging.getLogger(__name__)
+
+# How long a fetched terminal item is served from the cache
+ITEM_CACHE_TTL = timedelta(weeks=1)
+
+# Item requests in flight, shared by concurrent requesters of the same item
+_inflight_items: Dict[int, "asyncio.Task[Any]"] = {}
+
+
+async def fetch_item(session: aiohttp.ClientSession, item_id: int) -> Any:
+    """
+    Fetch a Hacker News item from the API.
+
+    Args:
+        session: The aiohttp client session
+        item_id: The ID of the item to fetch
+
+    Returns:
+        Item data as returned by the API, None for unknown items
+
+    Raises:
+        aiohttp.ClientError: If there's a network or HTTP error
+    """
+    async with session.get(f"{API_URL}/v0/item/{item_id}.json") as response:
+        response.raise_for_status()
+        return await response.json(loads=orjson.loads)
+
+
+def is_terminal(payload: Dict[str, Any]) -> bool:
+    """Check whether an item is deleted or dead, so its data no longer changes."""
+    return bool(payload.get("deleted") or payload.get("dead"))
+
+
+async def get_item(
+    db: Session,
+    session: aiohttp.ClientSession,
+    item_id: int,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """
+    Get a Hacker News item, from the cache when a fresh terminal copy is stored.
+
+    Otherwise the item is fetched from the API, and stored in the cache if it is terminal;
+    the caller is responsible for committing the session. Concurrent requests for the same
+    item share a single API request.
+
+    Args:
+        db: Database session
+        session: The aiohttp client session
+        item_id: The ID of the item to get
+        use_cache: Whether a cached copy may be returned; pass False to get the current state
+
+    Returns:
+        Item data dictionary
+
+    Raises:
+        aiohttp.ClientError: If there's a network or HTTP error
+    """
+    now = dtime.now(UTC)
+    if use_cache:
+        cached = db.get(HNItemCache, item_id)
+        if cached and cached.expires_at > now and is_terminal(cached.payload):
+            return cached.payload
+
+    task = _inflight_items.get(item_id)
+    if task:
+        # Another requester is already fetching the item and will cache it
+        payload = await asyncio.shield(task)
+        return payload if payload is not None else {}
+
+    task = asyncio.create_task(fetch_item(session, item_id))
+    _inflight_items[item_id] = task
+    task.add_done_callback(lambda _: _inflight_items.pop(item_id, None))
+    payload = await asyncio.shield(task)
+
+    # The API returns null for unknown items; don't cache those or live items
+    if payload is None:
+        return {}
+    if not is_terminal(payload):
+        return payload
+
+    stmt = insert(HNItemCache).values(
+        item_id=item_id,
+        payload=payload,
+        expires_at=now + ITEM_CACHE_TTL
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[HNItemCache.item_id],
+        set_={
+            "payload": stmt.excluded.payload,
+            "expires_at": stmt.excluded.expires_at
+        }
+    ))
+    return payload
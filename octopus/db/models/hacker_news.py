@@ -4,6 +4,7 @@ Database models for Hacker News stories, comments, and vote history.
 
 from typing import Optional
 from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, CheckConstraint, Boolean
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, validates
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import text
@@ -174,6 +175,27 @@ class StoryVotes(Base):
         return count
 
 
+class HNItemCache(Base):
+    """
+    Caches raw Hacker News API item responses to avoid re-fetching them on every run.
+
+    Attributes:
+        item_id (int): The primary key, the Hacker News item ID
+        payload (dict): The item as returned by the API
+        expires_at (datetime): When the cached item becomes stale
+    """
+
+    __tablename__ = "hn_item_cache"
+
+    item_id = Column(Integer, primary_key=True)
+    payload = Column(JSONB, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('idx_hn_item_cache_expires_at', 'expires_at'),
+    )
+
+
 # Update Story model to include comments relationship
 Story.comments = relationship(
     "StoryComment",
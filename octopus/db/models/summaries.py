@@ -75,6 +75,8 @@ class ItemTagRelation(Base):
 
     __table_args__ = (
         Index('idx_item_tag_relation_scores', 'relation_value'),
+        # Tag + minimum score lookups (digest story selection) as an index-only scan
+        Index('idx_item_tag_relation_tag_scores', 'tag_id', 'relation_value', 'item_id'),
     )
 
 
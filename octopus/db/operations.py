@@ -1,77 +1,204 @@
 """Shared database operations."""
 
-from typing import Optional
-from sqlalchemy import select
+import logging
+from datetime import datetime as dtime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 from sqlalchemy.orm import Session
 
-from octopus.db.models.summaries import ItemTag, ItemEntity
+from octopus.db.models.summaries import (
+    ItemTag, ItemEntity, ItemTagRelation, ItemEntityRelation, ProcessedItem
+)
 
+logger = logging.getLogger(__name__)
 
-def get_or_create_tag(db: Session, tag_name: str) -> ItemTag:
+
+def load_tag_ids(db: Session) -> Dict[str, int]:
+    """
+    Load IDs of all existing tags.
+    
+    Args:
+        db: Database session
+        
+    Returns:
+        Dict[str, int]: Tag IDs keyed by tag name
+    """
+    return dict(db.execute(select(ItemTag.name, ItemTag.id)).tuples())
+
+
+def get_or_create_tag_ids(
+    db: Session,
+    tag_names: Iterable[str],
+    tag_ids: Dict[str, int]
+) -> Dict[str, int]:
     """
-    Get existing tag or create new one.
+    Resolve tag names to IDs, creating missing tags with a single upsert.
     
     Args:
         db: Database session
-        tag_name: Name of the tag to get or create
+        tag_names: Names of the tags to resolve
+        tag_ids: Cache of known tag IDs keyed by name, updated in place
         
     Returns:
-        ItemTag: The retrieved or created tag
+        Dict[str, int]: The updated tag_ids cache
     """
-    stmt = select(ItemTag).where(ItemTag.name == tag_name)
-    tag = db.execute(stmt).scalar_one_or_none()
+    missing = {name for name in tag_names if name not in tag_ids}
+    if not missing:
+        return tag_ids
 
-    if not tag:
-        tag = ItemTag(name=tag_name)
-        db.add(tag)
-        db.commit()
+    stmt = (
+        pg_insert(ItemTag)
+        .values([{"name": name} for name in missing])
+        .on_conflict_do_nothing(index_elements=[ItemTag.name])
+        .returning(ItemTag.name, ItemTag.id)
+    )
+    tag_ids.update(db.execute(stmt).tuples())
 
-    return tag
+    # Tags created concurrently elsewhere are skipped by the upsert, so look them up
+    missing -= tag_ids.keys()
+    if missing:
+        tag_ids.update(
+            db.execute(select(ItemTag.name, ItemTag.id).where(ItemTag.name.in_(missing))).tuples()
+        )
 
+    return tag_ids
 
-def get_or_create_entity(db: Session, name: str, entity_type: str) -> ItemEntity:
+
+def get_or_create_entity_ids(
+    db: Session,
+    entity_keys: Iterable[Tuple[str, str]],
+    entity_ids: Dict[Tuple[str, str], int]
+) -> Dict[Tuple[str, str], int]:
     """
-    Get existing entity or create new one.
+    Resolve (name, type) pairs to entity IDs, creating missing entities in one insert.
     
     Args:
         db: Database session
-        name: Name of the entity
-        entity_type: Type of the entity (company, product, person, framework)
+        entity_keys: (name, entity_type) pairs to resolve
+        entity_ids: Cache of known entity IDs keyed by (name, type), updated in place
         
     Returns:
-        ItemEntity: The retrieved or created entity
+        Dict[Tuple[str, str], int]: The updated entity_ids cache
     """
-    stmt = select(ItemEntity).where(
-        ItemEntity.name == name,
-        ItemEntity.type == entity_type
+    missing = {key for key in entity_keys if key not in entity_ids}
+    if not missing:
+        return entity_ids
+
+    stmt = select(ItemEntity.name, ItemEntity.type, ItemEntity.id).where(
+        tuple_(ItemEntity.name, ItemEntity.type).in_(missing)
     )
-    entity = db.execute(stmt).scalar_one_or_none()
+    for name, entity_type, entity_id in db.execute(stmt):
+        entity_ids[(name, entity_type)] = entity_id
 
-    if not entity:
-        entity = ItemEntity(
-            name=name,
-            type=entity_type
+    missing -= entity_ids.keys()
+    if missing:
+        stmt = (
+            insert(ItemEntity)
+            .values([{"name": name, "type": entity_type} for name, entity_type in missing])
+            .returning(ItemEntity.name, ItemEntity.type, ItemEntity.id)
         )
-        db.add(entity)
-        db.commit()
+        for name, entity_type, entity_id in db.execute(stmt):
+            entity_ids[(name, entity_type)] = entity_id
 
-    return entity
+    return entity_ids
 
 
-def ensure_required_tags(db: Session, required_tags: list[str]) -> None:
+def save_processed_story(
+    db: Session,
+    item_type: str,
+    story_id: int,
+    processed_item: Optional[ProcessedItem],
+    summary: str,
+    tag_scores: Dict[str, float],
+    entities: List[Tuple[str, str, float, str]],
+    tag_ids: Dict[str, int],
+    entity_ids: Dict[Tuple[str, str], int],
+    now: dtime,
+    replace_relations: bool = True
+) -> Optional[ProcessedItem]:
     """
-    Ensure required tags exist in the database.
-    
+    Save the summary, tags and entities of a processed story.
+
+    Tag and entity IDs are resolved before the story's savepoint, so the run-wide ID caches
+    never refer to rows that were rolled back. The processed item and its relations are then
+    written in the savepoint, so a failing story doesn't abort the caller's batch; the caller
+    commits.
+
     Args:
         db: Database session
-        required_tags: List of required tag names
+        item_type: Type of the story, stored as ProcessedItem.related_item_type
+        story_id: ID of the story
+        processed_item: Existing processed item of the story to update, if any
+        summary: Generated summary
+        tag_scores: Tag scores keyed by tag name
+        entities: List of (name, type, score, context) tuples
+        tag_ids: Cache of known tag IDs keyed by name, updated in place
+        entity_ids: Cache of known entity IDs keyed by (name, type), updated in place
+        now: Processing timestamp
+        replace_relations: Whether to delete existing relations of processed_item first;
+            pass False when the caller already deleted them
+
+    Returns:
+        Optional[ProcessedItem]: The saved processed item, or None if saving failed
     """
-    for tag_name in required_tags:
-        stmt = select(ItemTag).where(ItemTag.name == tag_name)
-        tag = db.execute(stmt).scalar_one_or_none()
+    get_or_create_tag_ids(db, tag_scores, tag_ids)
+    get_or_create_entity_ids(
+        db,
+        [(name, entity_type) for name, entity_type, _, _ in entities],
+        entity_ids
+    )
+
+    try:
+        with db.begin_nested():
+            # Get existing or create new processed item
+            if processed_item:
+                if replace_relations:
+                    db.execute(
+                        delete(ItemTagRelation).where(ItemTagRelation.item_id == processed_item.id)
+                    )
+                    db.execute(
+                        delete(ItemEntityRelation)
+                        .where(ItemEntityRelation.item_id == processed_item.id)
+                    )
+
+                # Update existing item
+                processed_item.created_at = now
+                processed_item.summary = summary
+            else:
+                processed_item = ProcessedItem(
+                    created_at=now,
+                    summary=summary,
+                    related_item_type=item_type,
+                    related_item_id=story_id
+                )
+                db.add(processed_item)
+            db.flush()  # To get processed_item.id
+
+            # Create tag relations
+            db.execute(insert(ItemTagRelation), [
+                {
+                    "item_id": processed_item.id,
+                    "tag_id": tag_ids[tag_name],
+                    "relation_value": score
+                }
+                for tag_name, score in tag_scores.items()
+            ])
 
-        if not tag:
-            tag = ItemTag(name=tag_name)
-            db.add(tag)
+            # Create entity relations
+            if entities:
+                db.execute(insert(ItemEntityRelation), [
+                    {
+                        "item_id": processed_item.id,
+                        "entity_id": entity_ids[(name, entity_type)],
+                        "relation_value": score,
+                        "context": context
+                    }
+                    for name, entity_type, score, context in entities
+                ])
+    except (SQLAlchemyError, DBAPIError) as e:
+        logger.error(f"Failed to save {item_type} {story_id}: {str(e)}")
+        return None
 
-    db.commit()
+    return processed_item
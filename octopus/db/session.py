@@ -1,9 +1,10 @@
 import os
 import logging
-from typing import Generator, ContextManager
-from contextlib import contextmanager
+from typing import AsyncGenerator, Generator, ContextManager
+from contextlib import asynccontextmanager, contextmanager
 
 from sqlalchemy import URL, create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
@@ -16,10 +17,13 @@ load_dotenv()
 # Required database configuration
 REQUIRED_ENV_VARS = ['PGUSER', 'PGPASSWORD', 'PGHOST', 'PGDATABASE']
 
-def create_database_url() -> URL:
+def create_database_url(drivername: str = "postgresql+psycopg2") -> URL:
     """
     Create database URL from environment variables.
     
+    Args:
+        drivername: SQLAlchemy dialect and driver name
+    
     Returns:
         URL: SQLAlchemy URL object for database connection
         
@@ -39,7 +43,7 @@ def create_database_url() -> URL:
         raise TypeError(f"Invalid port number: {str(e)}")
     
     return URL.create(
-        drivername="postgresql+psycopg2",
+        drivername=drivername,
         username=os.environ['PGUSER'],
         password=os.environ['PGPASSWORD'],
         host=os.environ['PGHOST'],
@@ -61,6 +65,17 @@ try:
         bind=engine,
         expire_on_commit=False
     )
+    # Async engine for scripts that interleave database work with other awaits
+    async_engine = create_async_engine(
+        create_database_url("postgresql+asyncpg"),
+        echo=False,
+        echo_pool=False,
+        logging_name='sqlalchemy.engine'
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        expire_on_commit=False
+    )
 except (ValueError, TypeError) as e:
     logger.error(f"Failed to configure database: {str(e)}")
     raise
@@ -107,4 +122,24 @@ def session_scope():
         db.rollback()
         raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Provide an async transactional scope around a series of operations.
+    Usage:
+        async with async_session_scope() as db:
+            db.add(...)
+            await db.commit()
+    """
+    db = AsyncSessionLocal()
+    try:
+        yield db
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
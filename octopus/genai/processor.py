@@ -138,6 +138,7 @@ class GenAIProcessor:
         prompt: str,
         temperature: Optional[float],
         max_tokens: int,
+        system_prompt: Optional[str] = None,
     ) -> str:
         """Get completion from LLM.
         
@@ -145,13 +146,18 @@ class GenAIProcessor:
             prompt: The prompt to send
             temperature: Optional temperature override
             max_tokens: Maximum tokens in response
+            system_prompt: Optional static instructions, sent first as a system message
             
         Returns:
             Raw response content
         """
         full_response = []
+        messages = [{"role": "user", "content": prompt}]
+        if system_prompt:
+            # A stable leading message lets the provider reuse its cached prompt prefix
+            messages.insert(0, {"role": "system", "content": system_prompt})
         completion = await self._async_llm.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
             model=settings.azure_openai_deployment_name,
             # not supported by o4-mini
             # temperature=temperature if temperature is not None else self._default_temperature,
@@ -172,6 +178,7 @@ class GenAIProcessor:
         response_format: ResponseFormat = ResponseFormat.RAW,
         temperature: Optional[float] = None,
         max_tokens: int = 16_000,
+        system_prompt: Optional[str] = None,
     ) -> Union[str, Dict, List]:
         """Process a prompt with the LLM and return the response.
 
@@ -180,6 +187,8 @@ class GenAIProcessor:
             response_format: Expected format of the response
             temperature: Optional override for the temperature
             max_tokens: Maximum number of tokens in the response
+            system_prompt: Optional static instructions sent ahead of the prompt; keeping
+                them identical across calls allows provider-side prompt caching
 
         Returns:
             - For RAW format: string response
@@ -195,7 +204,9 @@ class GenAIProcessor:
             original_prompt = prompt
             
             while retries <= self._max_retries:
-                content = await self._get_completion(prompt, temperature, max_tokens)
+                content = await self._get_completion(
+                    prompt, temperature, max_tokens, system_prompt
+                )
                 cleaned_content = _clean_code_block(content)
                 
                 try:
@@ -204,7 +215,7 @@ class GenAIProcessor:
                     # Save prompt to database
                     with session_scope() as db:
                         db_prompt = Prompt(
-                            prompt_text=prompt,
+                            prompt_text=f"{system_prompt}\n\n{prompt}" if system_prompt else prompt,
                             response_text=cleaned_content,
                             response_format=response_format.value,
                             temperature=str(temperature) if temperature is not None else None,
@@ -1,15 +1,14 @@
 """
 Content extraction using DiffBot API.
 """
+import asyncio
 import logging
 import time
-from typing import Optional
+from typing import Dict, List, Optional
 import requests
 from requests.exceptions import HTTPError
-from sqlalchemy.orm import Session
 
 from octopus.settings import settings
-from octopus.db.models.hacker_news import Story
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +18,8 @@ class DiffBotExtractor:
     def __init__(self):
         self.api_key = settings.diffbot_api_key
         self.api_url = "https://api.diffbot.com/v3/article"
+        # Shared HTTP session so consecutive requests reuse pooled connections
+        self.session = requests.Session()
 
     def extract_content(self, url: str, max_retries: int = 3, initial_delay: float = 1.0) -> Optional[str]:
         """
@@ -46,7 +47,7 @@ class DiffBotExtractor:
                     "token": self.api_key,
                     "url": url
                 }
-                response = requests.get(self.api_url, params=params)
+                response = self.session.get(self.api_url, params=params)
                 response.raise_for_status()
 
                 data = response.json()
@@ -68,31 +69,28 @@ class DiffBotExtractor:
                 return None
 
         return None
-            
 
-def update_story_content(db: Session, story: Story) -> bool:
-    """
-    Update a story's target_content by extracting content from its URL.
-    
-    Args:
-        db: Database session
-        story: Story to update
-        
-    Returns:
-        bool: True if content was successfully extracted and updated
-    """
-    if not story.url:
-        logger.info(f"Story {story.id} has no URL to extract content from")
-        return False
+    async def extract_contents(
+        self, urls: List[str], max_concurrent: int = 10
+    ) -> Dict[str, Optional[str]]:
+        """
+        Extract article content from several URLs concurrently.
         
-    extractor = DiffBotExtractor()
-    content = extractor.extract_content(story.url)
-    
-    if content:
-        story.target_content = content
-        db.commit()
-        logger.info(f"Updated target content for story {story.id}")
-        return True
+        Requests run in worker threads over the shared HTTP session; at most
+        max_concurrent of them are in flight at once.
         
-    logger.warning(f"Failed to extract content for story {story.id}")
-    return False
+        Args:
+            urls: The URLs to extract content from
+            max_concurrent: Maximum number of concurrent requests
+            
+        Returns:
+            Dict[str, Optional[str]]: Extracted content (or None) keyed by URL
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def extract(url: str) -> Optional[str]:
+            async with semaphore:
+                return await asyncio.to_thread(self.extract_content, url)
+
+        contents = await asyncio.gather(*(extract(url) for url in urls))
+        return dict(zip(urls, contents))
@@ -1,11 +1,15 @@
 """Common functionality for generating digest contexts."""
 
-from datetime import datetime, timedelta, UTC
-from decimal import Decimal
-from typing import List, Optional, Tuple
+import heapq
+import logging
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
 
+import tiktoken
 from sqlalchemy import select, and_, desc
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, raiseload, selectinload
 
 from octopus.db.models.summaries import (
     ProcessedItem,
@@ -17,120 +21,226 @@ from octopus.db.models.summaries import (
 from octopus.db.models.hacker_news import Story
 from octopus.db.models.emails import EmailStory
 from octopus.db.models.telegram import TelegramStory
+from octopus.settings import settings
 
-# Approximate token limits (4 chars per token)
+logger = logging.getLogger(__name__)
+
+# Token limits
 MAX_CONTEXT_TOKENS = 100_000  # Leave room for prompt and response
-CHARS_PER_TOKEN = 4
+SUMMARY_WATERMARK = 1.5  # Over-limit ratio after which remaining stories use summaries
+TOKENIZER_MODEL = "gpt-4o"
+FALLBACK_ENCODING = "o200k_base"
 
-def estimate_tokens(text: str) -> int:
-    """Estimate number of tokens in text using character count."""
-    return len(text) // CHARS_PER_TOKEN
 
-def format_story_context(
-    story: ProcessedItem,
+@lru_cache(maxsize=4)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """Get the tiktoken encoding for a model, falling back to the default one."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def estimate_tokens(text: str, model: str = TOKENIZER_MODEL) -> int:
+    """Count number of tokens in text using the model's tokenizer."""
+    return len(_get_encoding(model).encode(text, disallowed_special=()))
+
+
+# Source story model for each ProcessedItem.related_item_type
+RELATED_STORY_MODELS = {
+    "hacker_news_story": Story,
+    "email_story": EmailStory,
+    "telegram_story": TelegramStory,
+}
+
+
+def load_related_stories(
     db: Session,
-    use_summary: bool = False,
-    relevant_entity_types: Optional[List[str]] = None
-) -> tuple[str, int]:
+    stories: List[ProcessedItem]
+) -> Dict[Tuple[str, int], Union[Story, EmailStory, TelegramStory]]:
     """
-    Format a story for context using full content or summary based on use_summary flag.
+    Load the source stories of processed items with one query per story type.
     
     Args:
-        story: The ProcessedItem to format
         db: Database session
-        use_summary: Whether to use summary instead of full content
+        stories: The ProcessedItems whose related stories should be loaded
+    
+    Returns:
+        dict: Related stories keyed by (related_item_type, related_item_id)
+    """
+    ids_by_type = defaultdict(set)
+    for story in stories:
+        ids_by_type[story.related_item_type].add(story.related_item_id)
+
+    related_stories = {}
+    for item_type, ids in ids_by_type.items():
+        model = RELATED_STORY_MODELS.get(item_type)
+        if model is None:
+            continue
+        stmt = select(model).where(model.id.in_(ids))
+        for related_story in db.execute(stmt).scalars():
+            related_stories[(item_type, related_story.id)] = related_story
+
+    return related_stories
+
+
+def group_entities_by_type(story: ProcessedItem) -> Dict[str, List[Tuple[str, str, str]]]:
+    """
+    Group a story's entity relations by entity type.
+    
+    Args:
+        story: The ProcessedItem with eager-loaded entities
+    
+    Returns:
+        dict: Entity type mapped to a list of (name, type, context) tuples
+    """
+    entities_by_type = defaultdict(list)
+    for relation in story.entities:
+        entity = relation.entity
+        entities_by_type[entity.type].append((entity.name, entity.type, relation.context))
+    return entities_by_type
+
+
+def build_story_parts(
+    story: ProcessedItem,
+    related_stories: Dict[Tuple[str, int], Union[Story, EmailStory, TelegramStory]],
+    relevant_entity_types: Optional[List[str]] = None,
+    entities_by_type: Optional[Dict[str, List[Tuple[str, str, str]]]] = None
+) -> Tuple[str, str, str, int]:
+    """
+    Build the parts of a story's context, so it can switch between content and summary
+    without being formatted again.
+    
+    Args:
+        story: The ProcessedItem to format
+        related_stories: Related stories as returned by load_related_stories
         relevant_entity_types: Optional list of entity types to filter by
+        entities_by_type: Optional pre-grouped entities from group_entities_by_type
     
     Returns:
-        tuple: (formatted context string, content length in characters)
+        tuple: (header, content block, summary block, content length in characters);
+            the content block falls back to the summary when no content is available
     """
     title = "Untitled"
     url = ""
     content = ""
 
     # Get the related story based on type
-    if story.related_item_type == "hacker_news_story":
-        stmt = select(Story).where(Story.id == story.related_item_id)
-        related_story = db.execute(stmt).scalar_one_or_none()
-        if related_story:
+    related_story = related_stories.get((story.related_item_type, story.related_item_id))
+    if related_story is not None:
+        if story.related_item_type == "hacker_news_story":
             title = related_story.title if related_story.title else "Untitled"
             url = f" ({related_story.url})" if related_story.url else ""
             content = related_story.target_content or related_story.content or ""
-    elif story.related_item_type == "email_story":
-        stmt = select(EmailStory).where(EmailStory.id == story.related_item_id)
-        related_story = db.execute(stmt).scalar_one_or_none()
-        if related_story:
+        elif story.related_item_type == "email_story":
             title = related_story.title if related_story.title else "Untitled"
             url = f" ({related_story.url})" if related_story.url else ""
-            content = related_story.target_content or related_story.content or ""
-    elif story.related_item_type == "telegram_story":
-        stmt = select(TelegramStory).where(TelegramStory.id == story.related_item_id)
-        related_story = db.execute(stmt).scalar_one_or_none()
-        if related_story:
+            content = related_story.target_content or ""
+        elif story.related_item_type == "telegram_story":
             title = f"Telegram: {related_story.channel_id}"
             url = f" (Message ID: {related_story.message_id})"
             content = related_story.content
     
-    # Use summary if flag is set or no content available
-    if use_summary or not content.strip():
-        content_section = f"Summary:\n{story.summary}"
+    # Use summary if no content available
+    summary_block = f"Summary:\n{story.summary}\n---\n"
+    if content.strip():
+        content_block = f"Content:\n{content}\n---\n"
     else:
-        content_section = f"Content:\n{content}"
+        content_block = summary_block
     
     # Format entities information
+    if entities_by_type is None:
+        entities_by_type = group_entities_by_type(story)
+    if relevant_entity_types:
+        entity_rows = [
+            row
+            for entity_type in relevant_entity_types
+            for row in entities_by_type.get(entity_type, ())
+        ]
+    else:
+        entity_rows = [row for rows in entities_by_type.values() for row in rows]
+
     entities_section = ""
-    if story.entities:
-        relevant_entities = story.entities
-        if relevant_entity_types:
-            relevant_entities = [
-                relation for relation in story.entities 
-                if relation.entity.entity_type in relevant_entity_types
-            ]
-        if relevant_entities:
-            entities_section = "Entities:\n"
-            for relation in relevant_entities:
-                entity = relation.entity
-                entities_section += f"- {entity.name} ({entity.entity_type}): {entity.description or 'No description available'}\n"
-            entities_section += "\n"
-
-    formatted_context = f"""Story: {title}{url}
+    if entity_rows:
+        entities_section = "".join([
+            "Entities:\n",
+            *(
+                f"- {name} ({entity_type}): {context or 'No description available'}\n"
+                for name, entity_type, context in entity_rows
+            ),
+            "\n"
+        ])
+
+    header = f"""Story: {title}{url}
 Type: {story.related_item_type}
 ID: {story.related_item_id}
-{entities_section}{content_section}
----
-"""
-    return formatted_context, len(content)
+{entities_section}"""
+    return header, content_block, summary_block, len(content)
+
+
+def format_story_context(
+    story: ProcessedItem,
+    related_stories: Dict[Tuple[str, int], Union[Story, EmailStory, TelegramStory]],
+    use_summary: bool = False,
+    relevant_entity_types: Optional[List[str]] = None,
+    entities_by_type: Optional[Dict[str, List[Tuple[str, str, str]]]] = None
+) -> tuple[str, int]:
+    """
+    Format a story for context using full content or summary based on use_summary flag.
+    
+    Args:
+        story: The ProcessedItem to format
+        related_stories: Related stories as returned by load_related_stories
+        use_summary: Whether to use summary instead of full content
+        relevant_entity_types: Optional list of entity types to filter by
+        entities_by_type: Optional pre-grouped entities from group_entities_by_type
+    
+    Returns:
+        tuple: (formatted context string, content length in characters)
+    """
+    header, content_block, summary_block, content_length = build_story_parts(
+        story, related_stories, relevant_entity_types, entities_by_type
+    )
+    return header + (summary_block if use_summary else content_block), content_length
 
 def get_relevant_stories(
     db: Session,
     relevant_tags: List[str],
-    days: int,
-    min_score: Decimal
+    start_date: datetime,
+    end_date: datetime,
+    min_score: float
 ) -> List[ProcessedItem]:
-    """Get relevant stories from the last N days."""
-    cutoff_date = datetime.now(UTC) - timedelta(days=days)
-    
+    """Get relevant stories within the specified date range."""
+    options = [
+        selectinload(ProcessedItem.tags).joinedload(ItemTagRelation.tag),
+        selectinload(ProcessedItem.entities).joinedload(ItemEntityRelation.entity)
+    ]
+    if settings.strict_eager_loading:
+        # Fail loudly on any relationship access that is not eager-loaded above
+        options.append(raiseload("*"))
+
     # Query for relevant stories
     stmt = (
         select(ProcessedItem)
         .join(ItemTagRelation)
-        .join(ItemTag)
         .where(
             and_(
-                ProcessedItem.created_at >= cutoff_date,
-                ItemTag.name.in_(relevant_tags),
+                ProcessedItem.created_at >= start_date,
+                ProcessedItem.created_at <= end_date,
+                # Resolve tag names to IDs once instead of joining the tags table
+                ItemTagRelation.tag_id.in_(
+                    select(ItemTag.id).where(ItemTag.name.in_(relevant_tags))
+                ),
+                # Bound with the column's NUMERIC type, so the column itself is never cast
                 ItemTagRelation.relation_value >= min_score
             )
         )
         .order_by(desc(ProcessedItem.created_at))
         .distinct()
-        .options(
-            joinedload(ProcessedItem.tags).joinedload(ItemTagRelation.tag),
-            joinedload(ProcessedItem.entities).joinedload(ItemEntityRelation.entity)
-        )
+        .options(*options)
     )
     
-    return db.execute(stmt).unique().scalars().all()
+    return db.execute(stmt).scalars().all()
 
 def prepare_context(
     stories: List[ProcessedItem],
@@ -141,49 +251,63 @@ def prepare_context(
     """
     Prepare context for the LLM by fitting stories within token limit.
     Falls back to summaries for largest stories if content exceeds token limit.
+    Once the running total passes SUMMARY_WATERMARK times the limit, the remaining
+    stories are formatted with summaries directly.
     """
     available_tokens = MAX_CONTEXT_TOKENS - prompt_tokens
-    context_parts = []
-    story_sizes = []  # List of (index, content_length) tuples
+    watermark_tokens = available_tokens * SUMMARY_WATERMARK
+    # Pre-sized so the first pass fills slots instead of growing the lists
+    context_parts = [""] * len(stories)
+    story_parts = [("", "")] * len(stories)  # (header, summary block) of each story
+    part_tokens = [0] * len(stories)  # Token count of each context part
+    content_lengths = [0] * len(stories)  # Full content length, 0 if summary is already used
     total_tokens = 0
+    related_stories = load_related_stories(db, stories)
     
     # First pass: Try to include full content for all stories
     for i, story in enumerate(stories):
-        story_context, content_length = format_story_context(
+        header, content_block, summary_block, content_length = build_story_parts(
             story,
-            db,
-            use_summary=False,
-            relevant_entity_types=relevant_entity_types
+            related_stories,
+            relevant_entity_types=relevant_entity_types,
+            entities_by_type=group_entities_by_type(story)
         )
+        # Once far over the limit, format the remaining stories as summaries right away
+        use_summary = total_tokens > watermark_tokens
+        story_context = header + (summary_block if use_summary else content_block)
         tokens = estimate_tokens(story_context)
-        story_sizes.append((i, content_length))
+        story_parts[i] = (header, summary_block)
+        content_lengths[i] = 0 if use_summary else content_length
+        part_tokens[i] = tokens
         total_tokens += tokens
-        context_parts.append(story_context)
+        context_parts[i] = story_context
+    
+    if total_tokens <= available_tokens:
+        return "\n".join(context_parts)
+    
+    logger.info(f"Total tokens ({total_tokens}) exceed limit ({available_tokens}), "
+                f"replacing largest stories with summaries")
     
-    # If total tokens exceed limit, replace largest stories with summaries
-    if total_tokens > available_tokens:
-        # Sort stories by content length, largest first
-        story_sizes.sort(key=lambda x: x[1], reverse=True)
+    # Total tokens exceed limit, replace largest stories with summaries.
+    # Only the largest stories are needed, so pop them from a heap instead of sorting
+    story_sizes = [(-length, i) for i, length in enumerate(content_lengths) if length]
+    heapq.heapify(story_sizes)
+    
+    # Replace largest stories with summaries until we're under the token limit
+    while story_sizes and total_tokens > available_tokens:
+        _, idx = heapq.heappop(story_sizes)
         
-        # Replace largest stories with summaries until we're under the token limit
-        for idx, _ in story_sizes:
-            if total_tokens <= available_tokens:
-                break
-                
-            # Replace full content with summary for this story
-            old_context = context_parts[idx]
-            new_context, _ = format_story_context(
-                stories[idx],
-                db,
-                use_summary=True,
-                relevant_entity_types=relevant_entity_types
-            )
-            
-            # Update total tokens
-            total_tokens -= estimate_tokens(old_context)
-            total_tokens += estimate_tokens(new_context)
-            
-            # Replace the context
-            context_parts[idx] = new_context
+        # Replace full content with summary for this story
+        header, summary_block = story_parts[idx]
+        new_context = header + summary_block
+        new_tokens = estimate_tokens(new_context)
+        
+        # Update total tokens
+        total_tokens += new_tokens - part_tokens[idx]
+        part_tokens[idx] = new_tokens
+        
+        # Replace the context
+        context_parts[idx] = new_context
+        logger.info(f"Replaced content with summary for story {stories[idx].related_item_id}")
     
     return "\n".join(context_parts)
@@ -1,11 +1,26 @@
+import asyncio
 import json
 import logging
-from typing import List, Tuple
+import re
+import string
+from typing import List, Optional, Tuple
 import yaml
 
 from octopus.genai.processor import GenAIProcessor
 logger = logging.getLogger(__name__)
 
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Leading ```/```yaml and trailing ``` markers of a fenced code block
+_CODE_FENCE_RE = re.compile(r"\A```(?:yaml)?|```\Z")
+
+# Maximum number of LLM requests in flight when processing stories concurrently
+MAX_CONCURRENT_REQUESTS = 8
+
 def _load_prompt() -> str:
     """Load the story analysis prompt from the txt file"""
     prompt_path = "octopus/genai/prompts/story_analysis.txt"
@@ -14,6 +29,22 @@ def _load_prompt() -> str:
 
 STORY_ANALYSIS_PROMPT = _load_prompt()
 
+# Literal chunks and placeholder names of the prompt, parsed once at import time
+_PROMPT_CHUNKS = [
+    (literal, field_name)
+    for literal, field_name, _, _ in string.Formatter().parse(STORY_ANALYSIS_PROMPT)
+]
+
+
+def _render_prompt(**fields) -> str:
+    """Render the story analysis prompt from its pre-parsed chunks"""
+    parts = []
+    for literal, field_name in _PROMPT_CHUNKS:
+        parts.append(literal)
+        if field_name is not None:
+            parts.append(str(fields[field_name]))
+    return "".join(parts)
+
 
 class EmptySummaryResult(Exception):
     """Exception raised when a summary result is empty"""
@@ -22,19 +53,9 @@ class EmptySummaryResult(Exception):
 
 def clean_yaml(yaml_str: str) -> str:
     """Clean up YAML string by removing invalid characters and code block markers"""
-    # Remove code block markers
-    yaml_str = yaml_str.strip()
-    if yaml_str.startswith("```yaml"):
-        yaml_str = yaml_str[7:]
-    elif yaml_str.startswith("```"):
-        yaml_str = yaml_str[3:]
-    if yaml_str.endswith("```"):
-        yaml_str = yaml_str[:-3]
-    
-    # Remove null characters
-    yaml_str = yaml_str.replace("\x00", "")
-    
-    return yaml_str.strip()
+    # Remove code block markers and null characters
+    yaml_str = _CODE_FENCE_RE.sub("", yaml_str.strip())
+    return yaml_str.replace("\x00", "").strip()
 
 class StoryProcessor:
     """Handles story-specific processing using GenAIProcessor"""
@@ -67,7 +88,7 @@ class StoryProcessor:
             comments_text = "\n".join(comments) if comments else "No comments available"
             
             # Process with LLM
-            prompt = STORY_ANALYSIS_PROMPT.format(
+            prompt = _render_prompt(
                 story_content=content,
                 target_content=target_content,
                 comments_content=comments_text
@@ -75,7 +96,7 @@ class StoryProcessor:
             response = await self.processor.process(prompt)
             
             try:
-                result = yaml.safe_load(clean_yaml(response))
+                result = yaml.load(clean_yaml(response), Loader=_YamlLoader)
             except yaml.YAMLError as e:
                 logger.error(f"Invalid YAML response from processor: {str(e)}")
                 return "Error: Invalid response format", [(tag, 0.5) for tag in self.required_tags], []
@@ -85,10 +106,11 @@ class StoryProcessor:
                 summary_data = result["summary"]
                 # If summary is a dict, get the text content
                 summary = summary_data["text"] if isinstance(summary_data, dict) else str(summary_data)
-                tags = [(item["name"], float(item["score"])) for item in result["tags"]]
+                # Duplicate tags/entities in the response collapse to the last occurrence
+                tag_dict = {item["name"]: float(item["score"]) for item in result["tags"]}
                 
                 # Extract entities with validation
-                entities = []
+                entity_dict = {}
                 valid_types = {"company", "product", "person", "framework"}
                 
                 for item in result.get("entities", []):
@@ -114,20 +136,59 @@ class StoryProcessor:
                         logger.warning(f"Skipping entity with non-numeric score: {score}")
                         continue
                         
-                    entities.append((name, entity_type, score, context))
+                    entity_dict[(name, entity_type)] = (score, context)
                 
             except (KeyError, ValueError) as e:
                 logger.error(f"Missing or invalid data in response: {str(e)}")
                 return "Error: Invalid response data", [(tag, 0.5) for tag in self.required_tags], []
 
             # Ensure required tags are included
-            tag_dict = dict(tags)
             for required_tag in self.required_tags:
-                if required_tag not in tag_dict:
-                    tags.append((required_tag, 0.0))
+                tag_dict.setdefault(required_tag, 0.0)
 
+            tags = list(tag_dict.items())
+            entities = [
+                (name, entity_type, score, context)
+                for (name, entity_type), (score, context) in entity_dict.items()
+            ]
             return summary, tags, entities
 
         except (ConnectionError, TimeoutError) as e:
             logger.error(f"Network error while processing content: {str(e)}")
             return f"Error: Network issue while processing", [(tag, 0.5) for tag in self.required_tags], []
+
+    async def process_contents(
+        self,
+        items: List[Tuple[str, str, Optional[List[str]]]],
+        max_concurrency: int = MAX_CONCURRENT_REQUESTS
+    ) -> List[Optional[Tuple[str, List[Tuple[str, float]], List[Tuple[str, str, float, str]]]]]:
+        """
+        Process several stories concurrently.
+
+        Args:
+            items: List of (content, target_content, comments) tuples, as for process_content
+            max_concurrency: Maximum number of LLM requests in flight
+
+        Returns:
+            Results of process_content in input order, None for stories with empty content
+
+        Raises:
+            Any other error of process_content; the remaining stories are cancelled first
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def process(item: Tuple[str, str, Optional[List[str]]]):
+            async with semaphore:
+                try:
+                    return await self.process_content(*item)
+                except EmptySummaryResult:
+                    return None
+
+        tasks = [asyncio.create_task(process(item)) for item in items]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # Don't leave LLM requests running unobserved when one of them fails
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
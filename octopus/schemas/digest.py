@@ -4,7 +4,7 @@ from datetime import datetime
 from decimal import Decimal
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 
 class TagScore(BaseModel):
@@ -29,6 +29,11 @@ class EntityMention(BaseModel):
     }
 
 
+# Built once so list validation runs in pydantic-core instead of per-item constructors
+_TAG_SCORES_ADAPTER = TypeAdapter(List[TagScore])
+_ENTITY_MENTIONS_ADAPTER = TypeAdapter(List[EntityMention])
+
+
 class DigestStoryBase(BaseModel):
     """Story with its metadata, tags, and entities."""
     processed_item_id: int
@@ -45,26 +50,27 @@ class DigestStoryBase(BaseModel):
 
     @classmethod
     def model_validate(cls, obj):
+        processed_item = obj.processed_item
         return cls(
             processed_item_id=obj.processed_item_id,
-            created_at=obj.processed_item.created_at,
-            summary=obj.processed_item.summary,
+            created_at=processed_item.created_at,
+            summary=processed_item.summary,
             url=None,  # Set if needed
             title=None,  # Set if needed
-            tags=[
-                TagScore(
-                    name=rel.tag.name,
-                    score=rel.relation_value
-                ) for rel in obj.processed_item.tags
-            ],
-            entities=[
-                EntityMention(
-                    name=rel.entity.name,
-                    type=rel.entity.type,
-                    context=rel.context,
-                    score=rel.relation_value
-                ) for rel in obj.processed_item.entities
-            ]
+            tags=_TAG_SCORES_ADAPTER.validate_python([
+                {
+                    "name": rel.tag.name,
+                    "score": rel.relation_value
+                } for rel in processed_item.tags
+            ]),
+            entities=_ENTITY_MENTIONS_ADAPTER.validate_python([
+                {
+                    "name": rel.entity.name,
+                    "type": rel.entity.type,
+                    "context": rel.context,
+                    "score": rel.relation_value
+                } for rel in processed_item.entities
+            ])
         )
 
 
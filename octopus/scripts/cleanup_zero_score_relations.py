@@ -2,7 +2,7 @@
 import logging
 import argparse
 
-from sqlalchemy import select
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
 
 from octopus.db.session import SessionLocal
@@ -13,29 +13,31 @@ logger = logging.getLogger(__name__)
 
 def cleanup_zero_score_relations(session: Session, dry_run: bool = False) -> None:
     """Remove all tag relations with a score of 0.0."""
-    # Find all relations with zero score
-    zero_score_relations = (
-        session.query(ItemTagRelation)
-        .filter(ItemTagRelation.relation_value == 0.0)
-        .all()
-    )
+    zero_score = ItemTagRelation.relation_value == 0.0
+
+    if dry_run:
+        # Count zero-score relations without loading them
+        count = session.scalar(
+            select(func.count()).select_from(ItemTagRelation).where(zero_score)
+        )
+        if not count:
+            logger.info("No zero-score relations found")
+            return
+        logger.info(f"Would remove {count} zero-score relations")
+        return
 
-    if not zero_score_relations:
+    # Delete zero-score relations in a single statement
+    result = session.execute(
+        delete(ItemTagRelation)
+        .where(zero_score)
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
         logger.info("No zero-score relations found")
         return
 
-    logger.info(f"Found {len(zero_score_relations)} zero-score relations")
-
-    # Delete zero-score relations
-    for relation in zero_score_relations:
-        msg = f"Removing zero-score relation: item_id={relation.item_id}, tag_id={relation.tag_id}"
-        logger.info(f"{'Would ' if dry_run else ''}{msg}")
-        if not dry_run:
-            session.delete(relation)
-
-    if not dry_run:
-        session.commit()
-        logger.info("Zero-score relations cleanup completed")
+    session.commit()
+    logger.info(f"Removed {result.rowcount} zero-score relations")
 
 
 async def main() -> None:
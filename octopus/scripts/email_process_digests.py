@@ -1,18 +1,64 @@
 """Script to process AI digest emails and extract links for analysis."""
 
 import asyncio
+import logging
 import os
 from datetime import datetime, timezone
+from collections import OrderedDict
 from typing import Optional, List
 
 from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from octopus.data_providers.gmail import GmailDigestProvider
 from octopus.db.models.emails import DigestEmail, DigestLink, EmailStory
 from octopus.db.session import session_scope
 from octopus.settings import settings
-from octopus.processing.url_normalizer import normalize_url_async
+from octopus.processing.url_normalizer import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Each normalization drives a headless browser, so keep the fan-out small
+MAX_CONCURRENT_NORMALIZATIONS = 5
+
+# Number of messages stored per transaction
+COMMIT_BATCH_SIZE = 50
+
+# Normalized URLs of recently seen raw URLs; digests repeat the same links
+MAX_CACHED_NORMALIZED_URLS = 50_000
+_normalized_url_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def cache_normalized_url(url: str, normalized: str) -> None:
+    """Remember the normalized form of a URL, evicting the least recently used entries."""
+    _normalized_url_cache[url] = normalized
+    _normalized_url_cache.move_to_end(url)
+    while len(_normalized_url_cache) > MAX_CACHED_NORMALIZED_URLS:
+        _normalized_url_cache.popitem(last=False)
+
+
+async def normalize_urls(urls: List[str]) -> List[str]:
+    """Normalize URLs concurrently, preserving their order; each distinct URL is normalized once."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_NORMALIZATIONS)
+
+    async def normalize(url: str) -> str:
+        async with semaphore:
+            return await normalize_url(url)
+
+    mapping = {}
+    for url in urls:
+        if url in _normalized_url_cache:
+            _normalized_url_cache.move_to_end(url)
+            mapping[url] = _normalized_url_cache[url]
+
+    new_urls = list(dict.fromkeys(url for url in urls if url not in mapping))
+    normalized = await asyncio.gather(*(normalize(url) for url in new_urls))
+    for url, normalized_url in zip(new_urls, normalized):
+        mapping[url] = normalized_url
+        cache_normalized_url(url, normalized_url)
+
+    return [mapping[url] for url in urls]
 
 
 async def process_links(
@@ -22,24 +68,36 @@ async def process_links(
     metadata: dict
 ) -> None:
     """Process and store links from an email."""
-    for link_data in links:
-        # Normalize URL
-        normalized_url = await normalize_url_async(link_data['url'])
-        
-        # Check if link already exists for this email
-        existing_link = session.scalar(
-            select(DigestLink).where(
+    if not links:
+        return
+
+    # Normalize URLs
+    normalized_urls = await normalize_urls([link_data['url'] for link_data in links])
+
+    # Look up existing links for this email and existing stories in one query each
+    existing_link_urls = set()
+    if email.id is not None:
+        existing_link_urls.update(session.scalars(
+            select(DigestLink.url).where(
                 DigestLink.email_id == email.id,
-                DigestLink.url == normalized_url
+                DigestLink.url.in_(normalized_urls)
             )
+        ))
+    stories_by_url = {
+        story.url: story
+        for story in session.scalars(
+            select(EmailStory).where(EmailStory.url.in_(normalized_urls))
         )
-        if existing_link:
+    }
+
+    for link_data, normalized_url in zip(links, normalized_urls):
+        # Check if link already exists for this email
+        if normalized_url in existing_link_urls:
             continue
+        existing_link_urls.add(normalized_url)
 
         # Check if story with this URL already exists
-        existing_story = session.scalar(
-            select(EmailStory).where(EmailStory.url == normalized_url)
-        )
+        existing_story = stories_by_url.get(normalized_url)
 
         link = DigestLink(
             email=email,
@@ -60,6 +118,7 @@ async def process_links(
                 source_email_id=email.id
             )
             session.add(story)
+            stories_by_url[normalized_url] = story
             link.story = story
             link.processed = True
 
@@ -68,31 +127,22 @@ async def process_links(
 
 async def process_message(
     session: Session,
-    message_data: dict,
-    provider: GmailDigestProvider
+    message_id: str,
+    message_details: Optional[dict]
 ) -> Optional[DigestEmail]:
     """Process a single digest email message."""
-    # Check if message exists
-    existing = session.scalar(
-        select(DigestEmail).where(DigestEmail.message_id == message_data['id'])
-    )
-    if existing:
-        return existing
-
-    # Get message details
-    message_details = provider.get_message_details(message_data['id'])
     if not message_details:
         return None
 
     # Extract metadata
-    metadata = provider.parse_message_metadata(message_details)
+    metadata = GmailDigestProvider.parse_message_metadata(message_details)
     
     # Extract content
-    content = provider.get_message_content(message_details)
+    content = GmailDigestProvider.get_message_content(message_details)
 
     # Create email
     email = DigestEmail(
-        message_id=message_data['id'],
+        message_id=message_id,
         sender=metadata['sender'],
         subject=metadata['subject'],
         received_at=metadata['received_at'],
@@ -102,7 +152,7 @@ async def process_message(
     session.add(email)
 
     # Extract and store links
-    links = provider.extract_links_from_content(content)
+    links = GmailDigestProvider.extract_links_from_content(content)
     await process_links(session, email, links, metadata)
 
     return email
@@ -123,10 +173,26 @@ async def main():
     )
 
     with session_scope() as session:
-        for message_data in messages:
-            email = await process_message(session, message_data, provider)
-            if email:
-                session.commit()
+        # Skip messages that are already stored
+        message_ids = [message_data['id'] for message_data in messages]
+        existing_ids = set(session.scalars(
+            select(DigestEmail.message_id).where(DigestEmail.message_id.in_(message_ids))
+        ))
+        new_ids = [message_id for message_id in message_ids if message_id not in existing_ids]
+
+        # Get message details with batch requests
+        messages_details = provider.get_messages_details_batch(new_ids)
+
+        for start in range(0, len(new_ids), COMMIT_BATCH_SIZE):
+            for message_id in new_ids[start:start + COMMIT_BATCH_SIZE]:
+                # Store each message in a savepoint, so a failing message doesn't abort the batch
+                try:
+                    with session.begin_nested():
+                        await process_message(session, message_id, messages_details[message_id])
+                except SQLAlchemyError as e:
+                    logger.error(f"Failed to store message {message_id}: {str(e)}")
+
+            session.commit()
 
 
 if __name__ == '__main__':
@@ -1,22 +1,21 @@
 """Script to process email stories and generate summaries."""
 
 import logging
-import pytz
-from datetime import datetime as dtime
-from typing import List, Tuple
+from datetime import datetime as dtime, UTC
+from typing import Dict, List, Optional, Tuple
 import asyncio
+from collections import OrderedDict
 
 from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
-from octopus.processing.story_processor import StoryProcessor, EmptySummaryResult
+from sqlalchemy.ext.asyncio import AsyncSession
+from octopus.processing.story_processor import StoryProcessor
 from octopus.db.models.emails import EmailStory
-from octopus.db.models.summaries import (
-    ProcessedItem, ItemTagRelation, ItemEntityRelation
-)
+from octopus.db.models.summaries import ProcessedItem
 from octopus.db.models.url_content import URLContent
-from octopus.db.session import session_scope
+from octopus.db.session import async_session_scope
 from octopus.processing.content_extractor import DiffBotExtractor
-from octopus.db.operations import get_or_create_tag, get_or_create_entity, ensure_required_tags
+from octopus.db.operations import get_or_create_tag_ids, load_tag_ids, save_processed_story
 
 logger = logging.getLogger(__name__)
 
@@ -26,22 +25,95 @@ REQUIRED_TAGS = ["machine learning", "generative ai", "cybersecurity"]
 story_processor = StoryProcessor(required_tags=REQUIRED_TAGS)
 content_extractor = DiffBotExtractor()
 
+# Maximum number of DiffBot requests in flight
+MAX_CONCURRENT_EXTRACTIONS = 10
 
-async def process_story_content(
-        story_content: str, content: str = None
-) -> Tuple[str, List[Tuple[str, float]], List[Tuple[str, str, float, str]]]:
+# Target content of recently seen URLs, shared across batches to skip repeated cache lookups
+MAX_CACHED_URL_CONTENTS = 10_000
+_url_content_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def cache_url_content(url: str, content: str) -> None:
+    """Remember extracted content of a URL, evicting the least recently used entries."""
+    _url_content_cache[url] = content
+    _url_content_cache.move_to_end(url)
+    while len(_url_content_cache) > MAX_CACHED_URL_CONTENTS:
+        _url_content_cache.popitem(last=False)
+
+
+async def extract_contents(urls: List[str]) -> Dict[str, Optional[str]]:
     """
-    Process story content using story processor.
+    Extract content for several URLs concurrently.
     
     Args:
-        story_content: The content to process
-        content: Optional extracted article content
+        urls: URLs to extract content from
         
     Returns:
-        Tuple[str, List[Tuple[str, float]], List[Tuple[str, str, float, str]]]: 
-            A tuple containing the summary, list of (tag, score) tuples, and list of (name, type, score, context) tuples
+        Dict[str, Optional[str]]: Extracted content (or None) keyed by URL
+    """
+    return await content_extractor.extract_contents(urls, MAX_CONCURRENT_EXTRACTIONS)
+
+
+async def fill_target_content(db: AsyncSession, stories: List[EmailStory]) -> None:
+    """
+    Set target content of stories from the URL cache, extracting missing content.
+    
+    Args:
+        db: Database session
+        stories: Stories to fill in; stories with content or without URL are skipped
     """
-    return await story_processor.process_content(story_content, content, None)
+    # Fill stories from the in-process cache first
+    for story in stories:
+        if story.url and not story.target_content and story.url in _url_content_cache:
+            _url_content_cache.move_to_end(story.url)
+            story.target_content = _url_content_cache[story.url]
+
+    urls = {story.url for story in stories if story.url and not story.target_content}
+    if not urls:
+        return
+
+    # Check cached content for the whole batch at once
+    url_contents = dict.fromkeys(urls)
+    for url_content in (await db.execute(
+        select(URLContent).where(URLContent.url.in_(urls))
+    )).scalars():
+        url_contents[url_content.url] = url_content
+        if url_content.target_content:
+            cache_url_content(url_content.url, url_content.target_content)
+
+    urls_to_extract = [
+        url for url, url_content in url_contents.items()
+        if not url_content or not url_content.target_content
+    ]
+
+    extracted = await extract_contents(urls_to_extract)
+
+    # Cache newly extracted content
+    now = dtime.now(UTC)
+    for url, content in extracted.items():
+        if not content:
+            continue
+        cache_url_content(url, content)
+        url_content = url_contents[url]
+        if url_content:
+            url_content.target_content = content
+            url_content.extracted_at = now
+            url_content.last_checked_at = now
+        else:
+            url_contents[url] = URLContent(
+                url=url,
+                target_content=content,
+                extracted_at=now,
+                last_checked_at=now
+            )
+            db.add(url_contents[url])
+
+    for story in stories:
+        if story.target_content or not story.url:
+            continue
+        url_content = url_contents.get(story.url)
+        if url_content and url_content.target_content:
+            story.target_content = url_content.target_content
 
 
 async def process_email_stories(force_regenerate: bool = False) -> None:
@@ -51,19 +123,22 @@ async def process_email_stories(force_regenerate: bool = False) -> None:
     Args:
         force_regenerate: If True, regenerate summaries for all stories, even if they already exist
     """
-    with session_scope() as db:
+    async with async_session_scope() as db:
         try:
-            # Ensure required tags exist
-            ensure_required_tags(db, REQUIRED_TAGS)
+            # Cache tag and entity IDs for the whole run, creating required tags up front
+            tag_ids = await db.run_sync(load_tag_ids)
+            await db.run_sync(get_or_create_tag_ids, REQUIRED_TAGS, tag_ids)
+            await db.commit()
+            entity_ids = {}
             
             # Process stories in batches
             batch_size = 100
-            offset = 0
+            last_id = 0  # Keyset pagination: resume after the last story of the previous batch
             
             while True:
                 # Get batch of stories
                 stmt = (
-                    select(EmailStory)
+                    select(EmailStory, ProcessedItem)
                     .outerjoin(
                         ProcessedItem,
                         (ProcessedItem.related_item_type == "email_story") &
@@ -74,127 +149,66 @@ async def process_email_stories(force_regenerate: bool = False) -> None:
                 if not force_regenerate:
                     stmt = stmt.where(ProcessedItem.id.is_(None))
                     
-                stmt = stmt.limit(batch_size).offset(offset)
-                stories = db.execute(stmt).unique().scalars().all()
+                stmt = stmt.where(EmailStory.id > last_id).order_by(EmailStory.id).limit(batch_size)
+                rows = (await db.execute(stmt)).unique().all()
                 
-                if not stories:
+                if not rows:
                     break
                 
-                # Process current batch
-                for story in stories:
-                    processed_item = db.execute(
-                        select(ProcessedItem).where(
-                            ProcessedItem.related_item_type == "email_story",
-                            ProcessedItem.related_item_id == story.id
-                        )
-                    ).scalar_one_or_none()
-
+                # Get or extract content for the whole batch before processing
+                await fill_target_content(db, [story for story, _ in rows])
+                await db.commit()
+                
+                # Collect stories of the current batch to process
+                pending = []
+                for story, processed_item in rows:
                     if processed_item and not force_regenerate:
                         continue
 
-                    # Get or extract content if not already present
-                    if not story.target_content and story.url:
-                        # Check if we have cached content
-                        url_content = db.execute(
-                            select(URLContent).where(URLContent.url == story.url)
-                        ).scalar_one_or_none()
-
-                        if url_content and url_content.target_content:
-                            story.target_content = url_content.target_content
-                        else:
-                            # Extract and cache content
-                            content = content_extractor.extract_content(story.url)
-                            if content:
-                                story.target_content = content
-                                # Cache the content
-                                now = pytz.utc.localize(dtime.now())
-                                url_content = URLContent(
-                                    url=story.url,
-                                    target_content=content,
-                                    extracted_at=now,
-                                    last_checked_at=now
-                                )
-                                db.add(url_content)
-                                db.flush()
-                        db.commit()
-                    
                     # Skip stories with empty content
                     if not story.target_content:
                         logger.info(f"Skipping story {story.id} due to empty content")
                         continue
 
-                    # Process story content
-                    try:
-                        summary, tags, entities = await process_story_content(
-                            story.title, story.target_content)
-                    except EmptySummaryResult:
+                    pending.append((story, processed_item, (story.title, story.target_content, None)))
+
+                # Process story contents concurrently
+                results = await story_processor.process_contents([inputs for _, _, inputs in pending])
+
+                for (story, processed_item, _), result in zip(pending, results):
+                    if result is None:
                         logger.warning(f"Failed to process story {story.id}")
                         continue
-                    
-                    # Get existing or create new processed item
-                    if force_regenerate:
-                        if processed_item:
-                            # Delete existing relations
-                            db.execute(
-                                ItemTagRelation.__table__.delete().where(
-                                    ItemTagRelation.item_id == processed_item.id
-                                )
-                            )
-                            db.execute(
-                                ItemEntityRelation.__table__.delete().where(
-                                    ItemEntityRelation.item_id == processed_item.id
-                                )
-                            )
-                            
-                            # Update existing item
-                            processed_item.created_at = pytz.utc.localize(dtime.now())
-                            processed_item.summary = summary
-                            db.flush()
-
-                    if not processed_item:
-                        processed_item = ProcessedItem(
-                            created_at=pytz.utc.localize(dtime.now()),
-                            summary=summary,
-                            related_item_type="email_story",
-                            related_item_id=story.id
-                        )
-                        db.add(processed_item)
-                        db.flush()  # To get processed_item.id
-
-                    # Create tag relations
-                    tag_dict = dict(tags)
-
-                    # Ensure required tags are included with at least 0.5 score
-                    for required_tag in REQUIRED_TAGS:
-                        if required_tag not in tag_dict:
-                            tag_dict[required_tag] = 0.0
-
-                    # Create tag relations
-                    for tag_name, score in tag_dict.items():
-                        tag = get_or_create_tag(db, tag_name)
-                        relation = ItemTagRelation(
-                            item_id=processed_item.id,
-                            tag_id=tag.id,
-                            relation_value=score
-                        )
-                        db.add(relation)
-
-                    # Create entity relations
-                    for name, entity_type, score, context in entities:
-                        entity = get_or_create_entity(db, name, entity_type)
-                        relation = ItemEntityRelation(
-                            item_id=processed_item.id,
-                            entity_id=entity.id,
-                            relation_value=score,
-                            context=context
-                        )
-                        db.add(relation)
+                    summary, tags, entities = result
+                    now = dtime.now(UTC)
+
+                    # Create tag relations, including required tags with a default score
+                    tag_dict = dict.fromkeys(REQUIRED_TAGS, 0.0)
+                    tag_dict.update(tags)
+
+                    # Resolve tag and entity IDs and save the story in its own savepoint
+                    processed_item = await db.run_sync(
+                        save_processed_story,
+                        "email_story",
+                        story.id,
+                        processed_item,
+                        summary,
+                        tag_dict,
+                        entities,
+                        tag_ids,
+                        entity_ids,
+                        now
+                    )
+                    if processed_item is None:
+                        continue
 
                     logger.info(f"Processed email story {story.id}")
-                    db.commit()
+
+                # Commit the whole batch at once
+                await db.commit()
                 
                 # Move to next batch
-                offset += batch_size
+                last_id = rows[-1][0].id
                 
         except (SQLAlchemyError, DBAPIError) as e:
             logger.error(f"Database error in main processing loop: {str(e)}")
@@ -14,15 +14,23 @@ logger = logging.getLogger(__name__)
 async def main():
     """Run the daily update process."""
     try:
-        # Get new stories from all sources
-        logger.info("Getting new stories from Telegram...")
-        await get_telegram_stories()
-        
-        logger.info("Getting new stories from Hacker News...")
-        await get_hn_stories()
-        
-        logger.info("Getting new stories from Email...")
-        await get_email_stories()
+        # Get new stories from all sources; the sources are independent, so fetch them
+        # concurrently and let every source finish even if another one fails
+        logger.info("Getting new stories from Telegram, Hacker News and Email...")
+        sources = ("Telegram", "Hacker News", "Email")
+        results = await asyncio.gather(
+            get_telegram_stories(),
+            get_hn_stories(),
+            get_email_stories(),
+            return_exceptions=True
+        )
+        errors = []
+        for source, result in zip(sources, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error getting new stories from {source}: {str(result)}")
+                errors.append(result)
+        if errors:
+            raise ExceptionGroup("Failed to get new stories", errors)
         
         # Update HN comments
         logger.info("Updating Hacker News comments...")
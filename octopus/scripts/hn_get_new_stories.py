@@ -1,13 +1,13 @@
 import logging
 import asyncio
-import ssl
-import certifi
-import pytz
-from datetime import datetime as dtime
+from datetime import datetime as dtime, UTC
+from typing import Any, Dict
 
 import aiohttp
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 
+from octopus.data_providers.hacker_news import SSL_CONTEXT
 from octopus.db.models.hacker_news import Story
 from octopus.db.session import session_scope
 from octopus.scripts.hn_update_story_votes import fetch_story_ids, fetch_story_info, update_story_votes
@@ -15,6 +15,10 @@ from octopus.processing.url_normalizer import normalize_url
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of HN API requests in flight
+MAX_CONCURRENT_REQUESTS = 20
+
+
 async def get_new_stories() -> None:
     """
     Fetch and store new stories from Hacker News.
@@ -24,23 +28,50 @@ async def get_new_stories() -> None:
         SQLAlchemyError: If there's a database error
     """
     logger.info("Fetching new stories")
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
 
     try:
         new_story_ids = await fetch_story_ids()
         logger.info("Found %d new stories", len(new_story_ids))
 
-        async with aiohttp.ClientSession() as session:
+        # Reuse connections and DNS lookups across the concurrent item requests
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONCURRENT_REQUESTS,
+            limit_per_host=MAX_CONCURRENT_REQUESTS,
+            ttl_dns_cache=300,
+            ssl=SSL_CONTEXT
+        )
+        async with aiohttp.ClientSession(connector=connector) as session:
             with session_scope() as db:
                 try:
-                    for new_story_id in new_story_ids:
-                        try:
-                            story = db.get(Story, new_story_id)
-                            if story:
-                                continue
-
-                            story_info = await fetch_story_info(session, new_story_id, ssl_context)
+                    # Skip stories that are already stored, checked with a single query
+                    existing_ids = set(
+                        db.execute(select(Story.id).where(Story.id.in_(new_story_ids))).scalars()
+                    )
+                    missing_ids = [
+                        story_id for story_id in new_story_ids if story_id not in existing_ids
+                    ]
+
+                    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+                    async def fetch(story_id: int) -> Dict[str, Any]:
+                        async with semaphore:
+                            return await fetch_story_info(session, story_id)
+
+                    # Fetch all missing stories concurrently, then store them in order
+                    results = await asyncio.gather(
+                        *(fetch(story_id) for story_id in missing_ids),
+                        return_exceptions=True
+                    )
+
+                    new_stories = []
+                    for new_story_id, story_info in zip(missing_ids, results):
+                        if isinstance(story_info, aiohttp.ClientError):
+                            logger.error("Failed to fetch story %d: %s", new_story_id, str(story_info))
+                            continue
+                        if isinstance(story_info, BaseException):
+                            raise story_info
 
+                        try:
                             if story_info.get('dead'):
                                 continue
 
@@ -49,26 +80,23 @@ async def get_new_stories() -> None:
                                 # url = await normalize_url(url)
                                 url = url[:1024] if url else None
 
-                            story = Story(
+                            new_stories.append(Story(
                                 id=new_story_id,
                                 title=story_info['title'],
                                 url=url,
                                 content=story_info.get('text'),
-                                posted_at=pytz.utc.localize(
-                                    dtime.fromtimestamp(story_info['time'])
-                                ),
+                                posted_at=dtime.fromtimestamp(story_info['time'], tz=UTC),
                                 user=story_info['by']
-                            )
-                            db.add(story)
+                            ))
 
-                        except aiohttp.ClientError as e:
-                            logger.error("Failed to fetch story %d: %s", new_story_id, str(e))
-                            continue
                         except KeyError as e:
                             logger.error("Invalid story data for %d: %s", new_story_id, str(e))
                             continue
 
-                        db.commit()
+                    # Store all new stories in a single transaction
+                    db.add_all(new_stories)
+                    db.commit()
+                    logger.info("Stored %d new stories", len(new_stories))
 
                 except (SQLAlchemyError, DBAPIError) as e:
                     db.rollback()
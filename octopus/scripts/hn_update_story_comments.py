@@ -1,29 +1,32 @@
 import logging
 import asyncio
-import ssl
-import certifi
-import pytz
 from datetime import datetime as dtime, timedelta, UTC
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 import aiohttp
-from sqlalchemy import select, or_
+import orjson
+from sqlalchemy import func, select, or_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 from sqlalchemy.orm import Session
 
+from octopus.data_providers.hacker_news import SSL_CONTEXT
+from octopus.data_providers.hacker_news.cache import get_item
 from octopus.db.models.hacker_news import Story, StoryComment
 from octopus.db.session import session_scope
 
 logger = logging.getLogger(__name__)
 
-async def fetch_story_comments(session: aiohttp.ClientSession, story_id: int, ssl_context: ssl.SSLContext) -> List[int]:
+# Maximum number of HN API requests in flight
+MAX_CONCURRENT_REQUESTS = 20
+
+async def fetch_story_comments(session: aiohttp.ClientSession, story_id: int) -> List[int]:
     """
     Fetch comment IDs for a story from the Hacker News API.
 
     Args:
         session: The aiohttp client session
         story_id: The ID of the story to fetch comments for
-        ssl_context: SSL context for HTTPS requests
 
     Returns:
         List of comment IDs
@@ -32,19 +35,27 @@ async def fetch_story_comments(session: aiohttp.ClientSession, story_id: int, ss
         aiohttp.ClientError: If there's a network or HTTP error
     """
     url = f"https://hacker-news.firebaseio.com/v0/item/{story_id}.json"
-    async with session.get(url, ssl=ssl_context) as response:
+    async with session.get(url) as response:
         response.raise_for_status()
-        story_data = await response.json()
+        story_data = await response.json(loads=orjson.loads)
         return story_data.get('kids', [])
 
-async def fetch_comment_info(session: aiohttp.ClientSession, comment_id: int, ssl_context: ssl.SSLContext) -> Dict[str, Any]:
+async def fetch_comment_info(
+    db: Session,
+    session: aiohttp.ClientSession,
+    comment_id: int,
+    use_cache: bool = True
+) -> Dict[str, Any]:
     """
     Fetch comment information from the Hacker News API.
 
+    Deleted and dead comments may be served from the item cache.
+
     Args:
+        db: Database session holding the item cache
         session: The aiohttp client session
         comment_id: The ID of the comment to fetch
-        ssl_context: SSL context for HTTPS requests
+        use_cache: Whether a cached copy may be returned
 
     Returns:
         Comment data dictionary
@@ -52,73 +63,133 @@ async def fetch_comment_info(session: aiohttp.ClientSession, comment_id: int, ss
     Raises:
         aiohttp.ClientError: If there's a network or HTTP error
     """
-    url = f"https://hacker-news.firebaseio.com/v0/item/{comment_id}.json"
-    async with session.get(url, ssl=ssl_context) as response:
-        response.raise_for_status()
-        return await response.json()
+    return await get_item(db, session, comment_id, use_cache)
 
-async def process_comment(
+async def collect_comment(
     db: Session,
     session: aiohttp.ClientSession,
     comment_id: int,
     story_id: int,
     parent_id: int | None,
-    ssl_context: ssl.SSLContext
-) -> None:
+    existing_comments: Dict[int, bool],
+    new_comments: List[Dict[str, Any]],
+    restored_comments: List[Dict[str, Any]]
+) -> List[int]:
     """
-    Process a single comment, storing it in the database and recursively processing its replies.
+    Collect a single comment for storing in bulk.
 
     Args:
-        db: Database session
+        db: Database session holding the item cache
         session: The aiohttp client session
         comment_id: The ID of the comment to process
         story_id: The ID of the story this comment belongs to
         parent_id: The ID of the parent comment, if any
-        ssl_context: SSL context for HTTPS requests
+        existing_comments: Deleted flags of the story's stored comments, keyed by comment ID
+        new_comments: Rows of comments to insert, appended to in place
+        restored_comments: Updates of previously deleted comments, appended to in place
+
+    Returns:
+        IDs of the replies to collect next, empty for existing or skipped comments
     """
     try:
         # Check if comment already exists
-        comment = db.get(StoryComment, comment_id)
-        if comment:
-            if comment.deleted:
-                # Re-check if comment is still deleted
-                comment_info = await fetch_comment_info(session, comment_id, ssl_context)
+        if comment_id in existing_comments:
+            if existing_comments[comment_id]:
+                # Re-check if comment is still deleted, bypassing the cached deleted copy
+                comment_info = await fetch_comment_info(db, session, comment_id, use_cache=False)
                 if not comment_info.get('deleted', True):
-                    comment.deleted = False
-                    comment.content = comment_info.get('text', '')
-                    db.commit()
-            return
+                    restored_comments.append({
+                        'id': comment_id,
+                        'deleted': False,
+                        'content': comment_info.get('text', '')
+                    })
+            return []
 
-        comment_info = await fetch_comment_info(session, comment_id, ssl_context)
+        comment_info = await fetch_comment_info(db, session, comment_id)
         
         # Skip deleted or dead comments
         if comment_info.get('deleted') or comment_info.get('dead'):
-            return
+            return []
 
         # Create new comment
-        comment = StoryComment(
-            id=comment_id,
-            story_id=story_id,
-            parent_id=parent_id,
-            content=comment_info.get('text', ''),
-            posted_at=pytz.utc.localize(
-                dtime.fromtimestamp(comment_info['time'])
-            ),
-            user=comment_info['by'],
-            deleted=False
-        )
-        db.add(comment)
-        db.commit()
-
-        # Process replies recursively
-        if 'kids' in comment_info:
-            for reply_id in comment_info['kids']:
-                await process_comment(db, session, reply_id, story_id, comment_id, ssl_context)
+        new_comments.append({
+            'id': comment_id,
+            'story_id': story_id,
+            'parent_id': parent_id,
+            'content': comment_info.get('text', ''),
+            'posted_at': dtime.fromtimestamp(comment_info['time'], tz=UTC),
+            'user': comment_info['by'],
+            'deleted': False
+        })
+        return comment_info.get('kids', [])
 
     except aiohttp.ClientError as e:
         logger.error(f"Failed to fetch comment {comment_id}: {str(e)}")
     except KeyError as e:
         logger.error(f"Invalid comment data for {comment_id}: {str(e)}")
+    return []
+
+async def collect_story_comments(
+    db: Session,
+    session: aiohttp.ClientSession,
+    story_id: int,
+    comment_ids: List[int]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Collect the comment tree of a story, without recursion.
+
+    The tree is traversed breadth-first from a queue of (comment_id, parent_id) pairs, drained
+    by MAX_CONCURRENT_REQUESTS workers; replies are queued once their parent is collected, so
+    parents always precede their replies in the returned rows.
+
+    Args:
+        db: Database session, used to look up existing comments and holding the item cache
+        session: The aiohttp client session
+        story_id: The ID of the story
+        comment_ids: IDs of the top-level comments of the story
+
+    Returns:
+        Tuple of (rows of new comments, updates of previously deleted comments)
+    """
+    # Look up the story's stored comments once instead of once per comment
+    existing_comments = dict(db.execute(
+        select(StoryComment.id, StoryComment.deleted).where(StoryComment.story_id == story_id)
+    ).all())
+
+    new_comments = []
+    restored_comments = []
+    queue: asyncio.Queue[Tuple[int, int | None]] = asyncio.Queue()
+    for comment_id in comment_ids:
+        queue.put_nowait((comment_id, None))
+
+    async def worker() -> None:
+        while True:
+            comment_id, parent_id = await queue.get()
+            try:
+                reply_ids = await collect_comment(
+                    db, session, comment_id, story_id, parent_id,
+                    existing_comments, new_comments, restored_comments
+                )
+                for reply_id in reply_ids:
+                    queue.put_nowait((reply_id, comment_id))
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(MAX_CONCURRENT_REQUESTS)]
+    drained = asyncio.create_task(queue.join())
+    try:
+        # Workers only finish early on an unexpected error; surface it instead of waiting forever
+        await asyncio.wait([drained, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for task in workers:
+            if task.done():
+                task.result()
+    finally:
+        drained.cancel()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(drained, *workers, return_exceptions=True)
+
+    return new_comments, restored_comments
 
 async def update_story_comments() -> None:
     """
@@ -129,47 +200,79 @@ async def update_story_comments() -> None:
         SQLAlchemyError: If there's a database error
     """
     logger.info("Starting comment update process")
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+    # Reuse connections and DNS lookups across all requests of the run
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENT_REQUESTS,
+        limit_per_host=MAX_CONCURRENT_REQUESTS,
+        ttl_dns_cache=300,
+        ssl=SSL_CONTEXT
+    )
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(connector=connector) as session:
             with session_scope() as db:
                 # Get current time in UTC
                 now = dtime.now(tz=UTC)
 
+                # Latest comment time of each story
+                latest_comments = (
+                    select(
+                        StoryComment.story_id,
+                        func.max(StoryComment.posted_at).label("latest_posted_at")
+                    )
+                    .group_by(StoryComment.story_id)
+                    .subquery()
+                )
+
                 # Get stories that:
                 # - are less than 2 days old AND
                 # - either have no comments OR their last comment is older than 6 hours
                 query = (
-                    select(Story)
+                    select(Story.id)
+                    .outerjoin(latest_comments, latest_comments.c.story_id == Story.id)
                     .where(
                         Story.posted_at >= (now - timedelta(days=2)),
                         or_(
-                            ~Story.comments.any(),  # No comments
-                            Story.comments.any(StoryComment.posted_at <= (now - timedelta(hours=6)))  # Old last comment
+                            latest_comments.c.latest_posted_at.is_(None),  # No comments
+                            latest_comments.c.latest_posted_at <= (now - timedelta(hours=6))  # Old last comment
                         )
                     )
                 )
                 
                 result = db.execute(query)
-                stories = result.scalars().all()
-
-                for story in stories:
-                    # Skip if story has comments and the most recent one is newer than 6 hours
-                    if story.comments:
-                        latest_comment = story.comments[0]  # Comments are ordered by posted_at desc
-                        if latest_comment.posted_at > (now - timedelta(hours=6)):
-                            continue
+                story_ids = result.scalars().all()
+
+                for story_id in story_ids:
                     try:
-                        logger.info(f"Fetching comments for story {story.id}")
-                        comment_ids = await fetch_story_comments(session, story.id, ssl_context)
-                        
-                        for comment_id in comment_ids:
-                            await process_comment(db, session, comment_id, story.id, None, ssl_context)
+                        logger.info(f"Fetching comments for story {story_id}")
+                        comment_ids = await fetch_story_comments(session, story_id)
+                        new_comments, restored_comments = await collect_story_comments(
+                            db, session, story_id, comment_ids
+                        )
+
+                        # Store the story's comments in a savepoint, so a failing story
+                        # doesn't abort the whole run
+                        try:
+                            with db.begin_nested():
+                                if new_comments:
+                                    # Comments stored concurrently by another run are left as is
+                                    db.execute(
+                                        insert(StoryComment).on_conflict_do_nothing(
+                                            index_elements=[StoryComment.id]
+                                        ),
+                                        new_comments
+                                    )
+                                if restored_comments:
+                                    db.execute(update(StoryComment), restored_comments)
+                        except (SQLAlchemyError, DBAPIError) as e:
+                            logger.error(f"Failed to save comments for story {story_id}: {str(e)}")
 
                     except aiohttp.ClientError as e:
-                        logger.error(f"Failed to fetch comments for story {story.id}: {str(e)}")
-                        continue
+                        logger.error(f"Failed to fetch comments for story {story_id}: {str(e)}")
+
+                    # Commit at story boundaries, together with the cached items
+                    db.commit()
 
     except (SQLAlchemyError, DBAPIError) as e:
         logger.error(f"Database error: {str(e)}")
@@ -3,34 +3,62 @@
 Script to update stories' target_content using DiffBot API.
 """
 import logging
-from sqlalchemy import select
+from sqlalchemy import select, update
 
 from octopus.db.session import session_scope
 from octopus.db.models.hacker_news import Story
-from octopus.processing.content_extractor import update_story_content
+from octopus.processing.content_extractor import DiffBotExtractor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of stories read per query and number of updates per commit
+BATCH_SIZE = 200
+COMMIT_BATCH_SIZE = 50
+
 def main():
     """Update target content for stories that don't have it yet."""
+    extractor = DiffBotExtractor()
+
     with session_scope() as db:
-        # Get stories that have URLs but no target content
-        stmt = select(Story).where(
-            Story.url.isnot(None),
-            Story.target_content.is_(None)
-        )
-        stories = db.execute(stmt).scalars().all()
-        
-        logger.info(f"Found {len(stories)} stories to process")
-        
+        processed_count = 0
         success_count = 0
-        for story in stories:
-            if not story.target_content:
-                if update_story_content(db, story):
-                    success_count += 1
-                
-        logger.info(f"Successfully updated {success_count} out of {len(stories)} stories")
+        last_id = 0  # Keyset pagination: resume after the last story of the previous batch
+
+        while True:
+            # Get stories that have URLs but no target content, reading only the needed columns
+            stmt = (
+                select(Story.id, Story.url)
+                .where(
+                    Story.url.isnot(None),
+                    Story.target_content.is_(None),
+                    Story.id > last_id
+                )
+                .order_by(Story.id)
+                .limit(BATCH_SIZE)
+            )
+            rows = db.execute(stmt).all()
+            if not rows:
+                break
+
+            for story_id, url in rows:
+                processed_count += 1
+                content = extractor.extract_content(url)
+                if not content:
+                    logger.warning(f"Failed to extract content for story {story_id}")
+                    continue
+
+                db.execute(update(Story).where(Story.id == story_id).values(target_content=content))
+                success_count += 1
+                logger.info(f"Updated target content for story {story_id}")
+
+                if success_count % COMMIT_BATCH_SIZE == 0:
+                    db.commit()
+
+            db.commit()
+            last_id = rows[-1].id
+
+        logger.info(f"Successfully updated {success_count} out of {processed_count} stories")
 
 if __name__ == "__main__":
     main()
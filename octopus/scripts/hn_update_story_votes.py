@@ -1,21 +1,28 @@
 import logging
 import asyncio
-import ssl
-import certifi
-import pytz
-from datetime import datetime as dtime
-from typing import Set, Dict, Any
+from datetime import datetime as dtime, UTC
+from typing import Set, Dict, Any, Optional
 
 import aiohttp
-from sqlalchemy import select
+import orjson
+from sqlalchemy import desc, insert, select
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 from octopus.db.models.hacker_news import Story, StoryVotes
-from octopus.data_providers.hacker_news import API_URL
+from octopus.data_providers.hacker_news import API_URL, SSL_CONTEXT
 from octopus.db.session import session_scope
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of HN API requests in flight
+MAX_CONCURRENT_REQUESTS = 20
+
+# Number of story IDs read from the database at a time
+STORY_ID_BATCH_SIZE = 1000
+
+# Number of vote updates stored per transaction
+VOTE_COMMIT_BATCH_SIZE = 500
+
 async def fetch_story_ids() -> Set[int]:
     """
     Fetch list of new story IDs from Hacker News API.
@@ -27,24 +34,25 @@ async def fetch_story_ids() -> Set[int]:
         aiohttp.ClientError: If there's a network or HTTP error
         json.JSONDecodeError: If the response is not valid JSON
     """
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
     async with aiohttp.ClientSession() as session:
         async with session.get(
             "https://hacker-news.firebaseio.com/v0/newstories.json?print=pretty",
-            ssl=ssl_context
+            ssl=SSL_CONTEXT
         ) as response:
             if response.status != 200:
                 raise aiohttp.ClientError(f"Hacker News returned HTTP {response.status}")
-            return set(await response.json())
+            return set(await response.json(loads=orjson.loads))
 
-async def fetch_story_info(session: aiohttp.ClientSession, story_id: int, ssl_context: ssl.SSLContext) -> Dict[str, Any]:
+async def fetch_story_info(
+    session: aiohttp.ClientSession,
+    story_id: int
+) -> Dict[str, Any]:
     """
     Fetch story details from Hacker News API.
     
     Args:
         session: aiohttp client session
         story_id: ID of the story to fetch
-        ssl_context: SSL context for HTTPS requests
         
     Returns:
         Dict[str, Any]: Story information
@@ -55,11 +63,11 @@ async def fetch_story_info(session: aiohttp.ClientSession, story_id: int, ssl_co
     """
     async with session.get(
         f"{API_URL}/v0/item/{story_id}.json?print=pretty",
-        ssl=ssl_context
+        ssl=SSL_CONTEXT
     ) as response:
         if response.status != 200:
             raise aiohttp.ClientError(f"Hacker News returned HTTP {response.status}")
-        return await response.json()
+        return await response.json(loads=orjson.loads)
 
 
 async def update_story_votes() -> None:
@@ -71,54 +79,95 @@ async def update_story_votes() -> None:
         SQLAlchemyError: If there's a database error
     """
     logger.info("Updating story votes")
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
     
     with session_scope() as db:
         try:
-            async with aiohttp.ClientSession() as session:
-                # Load all stories with their IDs
-                result = db.execute(select(Story.id))
-                story_ids = result.scalars().all()
-                
-                batch_size = 10
-                
-                for i, story_id in enumerate(story_ids, 1):
-                    try:
-                        # Fetch latest vote for this story
-                        vote_result = db.execute(
-                            select(StoryVotes.vote_count)
-                            .where(StoryVotes.story_id == story_id)
-                            .order_by(StoryVotes.tstamp.desc())
-                            .limit(1)
-                        )
-                        last_vote_count = vote_result.scalar_one_or_none()
-
-                        story_info = await fetch_story_info(session, story_id, ssl_context)
+            # Reuse connections and DNS lookups across the concurrent item requests
+            connector = aiohttp.TCPConnector(
+                limit=MAX_CONCURRENT_REQUESTS,
+                limit_per_host=MAX_CONCURRENT_REQUESTS,
+                ttl_dns_cache=300,
+                ssl=SSL_CONTEXT
+            )
+            async with aiohttp.ClientSession(connector=connector) as session:
+                # Fetch the latest vote count of every story in one query
+                last_votes = dict(db.execute(
+                    select(StoryVotes.story_id, StoryVotes.vote_count)
+                    .distinct(StoryVotes.story_id)
+                    .order_by(StoryVotes.story_id, desc(StoryVotes.tstamp))
+                ).all())
+
+                now = dtime.now(UTC)
+                new_votes = []
+                stored_count = 0
+
+                def store_votes() -> None:
+                    # Write buffered vote updates with one executemany and commit them
+                    nonlocal new_votes, stored_count
+                    if new_votes:
+                        db.execute(insert(StoryVotes), new_votes)
+                        db.commit()
+                        stored_count += len(new_votes)
+                        new_votes = []
+                queue: asyncio.Queue[Optional[int]] = asyncio.Queue(
+                    maxsize=MAX_CONCURRENT_REQUESTS * 2
+                )
+
+                async def produce() -> None:
+                    # Page story IDs by key while the workers fetch votes; no cursor is held
+                    # open across the commits of vote updates
+                    last_id = 0
+                    while story_ids := db.execute(
+                        select(Story.id)
+                        .where(Story.id > last_id)
+                        .order_by(Story.id)
+                        .limit(STORY_ID_BATCH_SIZE)
+                    ).scalars().all():
+                        for story_id in story_ids:
+                            await queue.put(story_id)
+                        last_id = story_ids[-1]
+                    for _ in range(MAX_CONCURRENT_REQUESTS):
+                        await queue.put(None)
+
+                async def work() -> None:
+                    while (story_id := await queue.get()) is not None:
+                        try:
+                            story_info = await fetch_story_info(session, story_id)
+                        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                            # ValueError covers malformed JSON bodies
+                            logger.error("Failed to fetch votes for story %d: %s", story_id, str(e))
+                            continue
+
                         story_score = story_info.get('score')
-                        
-                        if story_score is None or (last_vote_count and last_vote_count == story_score):
+                        last_vote_count = last_votes.get(story_id)
+                        if story_score is None or (
+                            last_vote_count and last_vote_count == story_score
+                        ):
                             continue
 
-                        story_vote = StoryVotes(
-                            story_id=story_id,
-                            vote_count=story_score,
-                            tstamp=pytz.utc.localize(dtime.now())
-                        )
-                        db.add(story_vote)
-                        
-                        # Commit every batch_size records
-                        if i % batch_size == 0:
-                            db.commit()
-                            logger.info("Committed batch of %d vote updates", batch_size)
-                        
-                    except aiohttp.ClientError as e:
-                        logger.error("Failed to fetch votes for story %d: %s", story_id, str(e))
-                        continue
-                
-                # Commit any remaining records
-                if i % batch_size != 0:
-                    db.commit()
-                    logger.info("Committed final batch of %d vote updates", i % batch_size)
+                        new_votes.append({
+                            'story_id': story_id,
+                            'vote_count': story_score,
+                            'tstamp': now
+                        })
+                        if len(new_votes) >= VOTE_COMMIT_BATCH_SIZE:
+                            store_votes()
+
+                tasks = [
+                    asyncio.create_task(produce()),
+                    *(asyncio.create_task(work()) for _ in range(MAX_CONCURRENT_REQUESTS))
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    # Don't leave the producer blocked on a full queue if a worker failed
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+                # Store the remaining vote updates
+                store_votes()
+                logger.info("Stored %d vote updates", stored_count)
                 
         except (SQLAlchemyError, DBAPIError) as e:
             db.rollback()
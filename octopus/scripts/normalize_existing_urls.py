@@ -4,7 +4,8 @@
 import asyncio
 import logging
 from collections import defaultdict
-from sqlalchemy import select, update, delete
+from typing import Dict, List
+from sqlalchemy import String, column, select, update, delete, values
 from sqlalchemy.orm import Session
 
 from octopus.db.models.emails import DigestLink, EmailStory
@@ -14,18 +15,24 @@ from octopus.processing.url_normalizer import normalize_url
 
 logger = logging.getLogger(__name__)
 
+# Each normalization drives a headless browser, so keep the fan-out small
+MAX_CONCURRENT_NORMALIZATIONS = 5
+
 
 async def get_url_mapping(urls):
-    """Create mapping of original URLs to their normalized versions."""
-    mapping = {}
-    for url in urls:
-        try:
-            normalized = await normalize_url(url)
-            mapping[url] = normalized
-        except Exception as e:
-            logger.error(f"Error normalizing URL {url}: {e}")
-            mapping[url] = url  # Keep original if normalization fails
-    return mapping
+    """Create mapping of original URLs to their normalized versions, normalizing concurrently."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_NORMALIZATIONS)
+
+    async def normalize(url):
+        async with semaphore:
+            try:
+                return await normalize_url(url)
+            except Exception as e:
+                logger.error(f"Error normalizing URL {url}: {e}")
+                return url  # Keep original if normalization fails
+
+    urls = list(urls)
+    return dict(zip(urls, await asyncio.gather(*(normalize(url) for url in urls))))
 
 
 async def find_conflicts(mapping):
@@ -37,89 +44,127 @@ async def find_conflicts(mapping):
     return {k: v for k, v in conflicts.items() if len(v) > 1}
 
 
-async def normalize_digest_links(session: Session) -> int:
+def bulk_update_urls(session: Session, model, url_updates: Dict[str, str]) -> int:
+    """
+    Replace URLs of a table in a single UPDATE ... FROM (VALUES ...) statement.
+
+    Args:
+        session: Database session
+        model: Model class with a url column
+        url_updates: Mapping of original URLs to their replacements
+
+    Returns:
+        Number of updated rows
+    """
+    if not url_updates:
+        return 0
+
+    url_mapping = values(
+        column("old_url", String), column("new_url", String), name="url_mapping"
+    ).data(list(url_updates.items()))
+    stmt = (
+        update(model)
+        .where(model.url == url_mapping.c.old_url)
+        .values(url=url_mapping.c.new_url)
+        .execution_options(synchronize_session=False)
+    )
+    return session.execute(stmt).rowcount
+
+
+def load_urls(session: Session) -> Dict[str, List[str]]:
+    """Get the distinct URLs of each table, keyed by table name."""
+    return {
+        "digest_links": session.execute(select(DigestLink.url).distinct()).scalars().all(),
+        "email_stories": session.execute(select(EmailStory.url).distinct()).scalars().all(),
+        "stories": session.execute(
+            select(Story.url).distinct().where(Story.url.isnot(None))
+        ).scalars().all(),
+    }
+
+
+async def normalize_digest_links(
+    session: Session,
+    urls: List[str],
+    url_mapping: Dict[str, str]
+) -> int:
     """Normalize URLs in digest_links table."""
-    # Get all unique URLs
-    stmt = select(DigestLink.url).distinct()
-    urls = session.execute(stmt).scalars().all()
-    
-    # Create URL mapping and find conflicts
-    mapping = await get_url_mapping(urls)
+    # Find conflicts among the table's URLs
+    mapping = {url: url_mapping[url] for url in urls}
     conflicts = await find_conflicts(mapping)
     
-    updated = 0
-    for normalized, originals in conflicts.items():
-        # For each set of conflicting URLs, keep one and update others to point to it
-        keep_url = originals[0]
-        other_urls = originals[1:]
-        
-        # Get all links that use the URLs we want to update
-        for url in other_urls:
-            # Find links using this URL
-            links = session.execute(
-                select(DigestLink).where(DigestLink.url == url)
-            ).scalars().all()
-            
-            # Update each link to use the URL we're keeping
-            for link in links:
-                link.url = normalized
-            updated += len(links)
-        
-        session.commit()
-    
-    # Now handle non-conflicting URLs
-    for url, normalized in mapping.items():
-        if url != normalized and url not in {u for urls in conflicts.values() for u in urls}:
-            stmt = update(DigestLink).where(DigestLink.url == url).values(url=normalized)
-            result = session.execute(stmt)
-            updated += result.rowcount
-            session.commit()
+    # For each set of conflicting URLs, keep one and update others to point to it
+    conflicting_urls = {url for originals in conflicts.values() for url in originals}
+    url_updates = {
+        url: normalized
+        for normalized, originals in conflicts.items()
+        for url in originals[1:]
+    }
+    # Non-conflicting URLs are updated as usual
+    url_updates.update(
+        (url, normalized) for url, normalized in mapping.items()
+        if url != normalized and url not in conflicting_urls
+    )
+
+    updated = bulk_update_urls(session, DigestLink, url_updates)
+    session.commit()
     
     return updated
 
 
-async def normalize_email_stories(session: Session) -> int:
+async def normalize_email_stories(
+    session: Session,
+    urls: List[str],
+    url_mapping: Dict[str, str]
+) -> int:
     """Normalize URLs in email_stories table."""
-    stmt = select(EmailStory.url).distinct()
-    urls = session.execute(stmt).scalars().all()
-    
-    mapping = await get_url_mapping(urls)
-    updated = 0
+    mapping = {url: url_mapping[url] for url in urls}
+    url_updates = {}
+
+    # Find normalized URLs that already exist with a single query
+    changed_urls = {normalized for url, normalized in mapping.items() if url != normalized}
+    existing_urls = set(session.execute(
+        select(EmailStory.url).where(EmailStory.url.in_(changed_urls))
+    ).scalars()) if changed_urls else set()
     
     for url, normalized in mapping.items():
         if url != normalized:
-            # Check if normalized URL already exists
-            existing = session.scalar(
-                select(EmailStory).where(EmailStory.url == normalized)
-            )
-            if not existing:
-                stmt = update(EmailStory).where(EmailStory.url == url).values(url=normalized)
-                result = session.execute(stmt)
-                updated += result.rowcount
-                session.commit()
+            # Skip normalized URLs that exist or are already taken by an earlier update
+            if normalized in existing_urls:
+                continue
+            url_updates[url] = normalized
+            existing_urls.add(normalized)
+    
+    updated = bulk_update_urls(session, EmailStory, url_updates)
+    session.commit()
     
     return updated
 
 
-async def normalize_hn_stories(session: Session) -> int:
+async def normalize_hn_stories(
+    session: Session,
+    urls: List[str],
+    url_mapping: Dict[str, str]
+) -> int:
     """Normalize URLs in stories table."""
-    stmt = select(Story.url).distinct().where(Story.url.isnot(None))
-    urls = session.execute(stmt).scalars().all()
-    
-    mapping = await get_url_mapping(urls)
-    updated = 0
+    mapping = {url: url_mapping[url] for url in urls}
+    url_updates = {}
+
+    # Find normalized URLs that already exist with a single query
+    changed_urls = {normalized for url, normalized in mapping.items() if url != normalized}
+    existing_urls = set(session.execute(
+        select(Story.url).where(Story.url.in_(changed_urls))
+    ).scalars()) if changed_urls else set()
     
     for url, normalized in mapping.items():
         if url != normalized:
-            # Check if normalized URL already exists
-            existing = session.scalar(
-                select(Story).where(Story.url == normalized)
-            )
-            if not existing:
-                stmt = update(Story).where(Story.url == url).values(url=normalized)
-                result = session.execute(stmt)
-                updated += result.rowcount
-                session.commit()
+            # Skip normalized URLs that exist or are already taken by an earlier update
+            if normalized in existing_urls:
+                continue
+            url_updates[url] = normalized
+            existing_urls.add(normalized)
+    
+    updated = bulk_update_urls(session, Story, url_updates)
+    session.commit()
     
     return updated
 
@@ -133,10 +178,17 @@ async def main():
 
     with session_scope() as session:
         try:
+            # Normalize each distinct URL once, even if it appears in several tables
+            urls = load_urls(session)
+            all_urls = set().union(*urls.values())
+            url_mapping = await get_url_mapping(all_urls)
+
             # Update URLs in each table
-            digest_links = await normalize_digest_links(session)
-            email_stories = await normalize_email_stories(session)
-            hn_stories = await normalize_hn_stories(session)
+            digest_links = await normalize_digest_links(session, urls["digest_links"], url_mapping)
+            email_stories = await normalize_email_stories(
+                session, urls["email_stories"], url_mapping
+            )
+            hn_stories = await normalize_hn_stories(session, urls["stories"], url_mapping)
             
             print(f"\nUpdated URLs:")
             print(f"- Digest Links: {digest_links}")
@@ -2,19 +2,25 @@
 import os
 import logging
 import argparse
-from typing import Dict, List, Union
+from functools import lru_cache
+from typing import Dict, List, Set, Union
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, exists, select
+from sqlalchemy.orm import Session, selectinload
 
+from octopus.db.operations import get_or_create_tag_ids
 from octopus.db.session import SessionLocal
 from octopus.genai.processor import GenAIProcessor, ResponseFormat
 from octopus.db.models.summaries import ItemTag, ItemTagRelation, ProcessedItem
-from octopus.db.models.hacker_news import Story
+from octopus.db.models.hacker_news import Story, StoryComment
 
 logger = logging.getLogger(__name__)
 
+# Number of rows fetched at a time when streaming items and relations
+STREAM_BATCH_SIZE = 1000
 
+
+@lru_cache(maxsize=1)
 def get_prompt() -> str:
     """Read the tag analysis prompt from file."""
     prompt_path = os.path.join(os.path.dirname(__file__), "..", "genai", "prompts", "revise_tags.txt")
@@ -37,13 +43,14 @@ async def get_tag_mapping(
         f"- {tag.name if isinstance(tag, ItemTag) else tag}"
         for tag in tags
     )
-    prompt = get_prompt().format(tags=tags_list)
 
     try:
-        # Use YAML response format with automatic validation, parsing and retries
+        # Use YAML response format with automatic validation, parsing and retries; the static
+        # instructions go first so the provider can cache them, only the tags list varies
         result = await processor.process(
-            prompt,
-            response_format=ResponseFormat.YAML
+            f"Tags:\n{tags_list}",
+            response_format=ResponseFormat.YAML,
+            system_prompt=get_prompt()
         )
         
         if not isinstance(result, dict) or "tag_mapping" not in result:
@@ -74,6 +81,38 @@ async def get_tag_mapping(
         raise
 
 
+def create_new_tags(
+    session: Session,
+    tag_names: Set[str],
+    tag_name_to_id: Dict[str, int],
+    dry_run: bool = False
+) -> Dict[str, int]:
+    """
+    Resolve target tag names to IDs, creating missing tags in a single statement.
+
+    Args:
+        session: Database session
+        tag_names: Target tag names of the mapping
+        tag_name_to_id: IDs of existing tags keyed by name
+        dry_run: If True, only log the tags that would be created
+
+    Returns:
+        Dict[str, int]: Tag IDs keyed by name, -1 for tags not created in dry-run mode
+    """
+    missing = sorted(tag_names - tag_name_to_id.keys())
+
+    if dry_run:
+        # In dry-run mode, just show what would be created/updated
+        for new_name in missing:
+            logger.info(f"Would create new tag: {new_name}")
+        return {name: tag_name_to_id.get(name, -1) for name in tag_names}  # Dummy ID for dry run
+
+    tag_ids = get_or_create_tag_ids(session, missing, dict(tag_name_to_id))
+    for new_name in missing:
+        logger.info(f"Created new tag: {new_name}")
+    return {name: tag_ids[name] for name in tag_names}
+
+
 def update_tag_relations(
     session: Session,
     old_to_new_tags: Dict[str, List[str]],
@@ -82,162 +121,180 @@ def update_tag_relations(
     dry_run: bool = False
 ) -> None:
     """Update all tag relations based on the mapping."""
-    # Log tag conversions
+    # Keep only tags that actually change, with lowercase target names
+    changed_tags = {}
     for old_tag, new_tags in old_to_new_tags.items():
-        if len(new_tags) == 1 and old_tag == new_tags[0]:
+        new_tag_names = [new_tag.lower() for new_tag in new_tags]
+        if len(new_tag_names) == 1 and old_tag == new_tag_names[0]:
             continue  # Skip if tag remains the same
+        changed_tags[old_tag] = new_tag_names
+
+    # Log tag conversions
+    for old_tag, new_tags in changed_tags.items():
         logger.info(f"Converting tag '{old_tag}' to {new_tags}")
 
-    # Process each item's tags
-    items = session.query(ProcessedItem).all()
-    processed_relations = set()
-
-    for item in items:
-        # Get all tag relations for this item
-        item_relations = (
-            session.query(ItemTagRelation)
-            .join(ItemTag)
-            .filter(
-                ItemTagRelation.item_id == item.id,
-                ItemTag.name.in_(old_to_new_tags.keys())
-            )
+    if not changed_tags:
+        return
+
+    # (item_id, tag_id) pairs of existing target tag relations on affected items, to merge into;
+    # kept up to date as relations are created, retargeted and deleted
+    existing_pairs = set()
+    if not dry_run:
+        affected_items = (
+            select(ItemTagRelation.item_id)
+            .join(ItemTag, ItemTagRelation.tag_id == ItemTag.id)
+            .where(ItemTag.name.in_(changed_tags.keys()))
         )
+        existing_pairs = set(session.execute(
+            select(ItemTagRelation.item_id, ItemTagRelation.tag_id)
+            .where(
+                ItemTagRelation.tag_id.in_({
+                    new_tag_ids[name] for names in changed_tags.values() for name in names
+                }),
+                ItemTagRelation.item_id.in_(affected_items)
+            )
+        ).tuples())
+
+    # Stream the relations of all mapped tags from a single query, grouped by item
+    relations = session.execute(
+        select(ItemTagRelation, ItemTag.name)
+        .join(ItemTag, ItemTagRelation.tag_id == ItemTag.id)
+        .where(ItemTag.name.in_(changed_tags.keys()))
+        .order_by(ItemTagRelation.item_id)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
 
-        for relation in item_relations:
-            old_tag = session.get(ItemTag, relation.tag_id)
-            if not old_tag or relation in processed_relations:
-                continue
-            processed_relations.add(relation)
+    for relation, old_tag_name in relations:
+        item_id = relation.item_id
+        new_tag_names = changed_tags[old_tag_name]
 
-            new_tag_names = old_to_new_tags[old_tag.name]
+        # Handle tag splitting and merging
+        if len(new_tag_names) > 1:
+            # Tag is being split into multiple tags
+            msg = (
+                f"Item {item_id}: Splitting tag '{old_tag_name}' into {new_tag_names} "
+                f"with score {relation.relation_value}"
+            )
+            logger.info(f"{'Would ' if dry_run else ''}split tag: {msg}")
+
+            if not dry_run:
+                # Create new relations for each split tag
+                for new_tag_name in new_tag_names:
+                    # Skip if this would create a self-reference
+                    if new_tag_name == old_tag_name:
+                        continue
+
+                    key = (item_id, new_tag_ids[new_tag_name])
+                    if key not in existing_pairs and relation.relation_value > 0.0:
+                        # Only create new relation if score is not zero
+                        new_relation = ItemTagRelation(
+                            item_id=item_id,
+                            tag_id=new_tag_ids[new_tag_name],
+                            relation_value=relation.relation_value
+                        )
+                        session.add(new_relation)
+                        existing_pairs.add(key)
 
-            # Handle tag splitting and merging
-            if len(new_tag_names) > 1:
-                # Tag is being split into multiple tags
-                msg = (
-                    f"Item {item.id}: Splitting tag '{old_tag.name}' into {new_tag_names} "
-                    f"with score {relation.relation_value}"
+        else:
+            # Single tag mapping
+            new_tag_name = new_tag_names[0]
+            msg = f"Item {item_id}: Converting tag '{old_tag_name}' to '{new_tag_name}'"
+            logger.info(f"{'Would ' if dry_run else ''}convert tag: {msg}")
+
+            if not dry_run:
+                # Check if relation already exists for the new tag
+                key = (item_id, new_tag_ids[new_tag_name])
+                existing_relation = (
+                    session.get(ItemTagRelation, key) if key in existing_pairs else None
                 )
-                logger.info(f"{'Would ' if dry_run else ''}split tag: {msg}")
-
-                if not dry_run:
-                    # Create new relations for each split tag
-                    for new_tag_name in new_tag_names:
-                        new_tag_name = new_tag_name.lower()
-
-                        # Skip if this would create a self-reference
-                        if new_tag_name == old_tag.name:
-                            continue
-
-                        existing_relation = (
-                            session.query(ItemTagRelation)
-                            .filter(
-                                ItemTagRelation.item_id == item.id,
-                                ItemTagRelation.tag_id == new_tag_ids[new_tag_name]
-                            )
-                        ).first()
-
-                        if not existing_relation and relation.relation_value > 0.0:
-                            # Only create new relation if score is not zero
-                            new_relation = ItemTagRelation(
-                                item_id=item.id,
-                                tag_id=new_tag_ids[new_tag_name],
-                                relation_value=relation.relation_value
-                            )
-                            session.add(new_relation)
-
-            else:
-                # Single tag mapping
-                new_tag_name = new_tag_names[0].lower()
-
-                if new_tag_name == old_tag.name:
-                    # Tag remains the same
-                    continue
-
-                msg = f"Item {item.id}: Converting tag '{old_tag.name}' to '{new_tag_name}'"
-                logger.info(f"{'Would ' if dry_run else ''}convert tag: {msg}")
-
-                if not dry_run:
-                    # Check if relation already exists for the new tag
-                    existing_relation = (
-                        session.query(ItemTagRelation)
-                        .filter(
-                            ItemTagRelation.item_id == item.id,
-                            ItemTagRelation.tag_id == new_tag_ids[new_tag_name]
-                        )
-                    ).first()
 
-                    if existing_relation:
-                        # Keep highest non-zero score if merging
-                        new_score = max(
-                            existing_relation.relation_value,
-                            relation.relation_value
-                        )
-                        if new_score > 0.0:
-                            existing_relation.relation_value = new_score
-                        else:
-                            # If both scores are zero, remove the relation
-                            session.delete(existing_relation)
-                        session.delete(relation)
-                    elif relation.relation_value > 0.0:
-                        # Only update if score is not zero
-                        relation.tag_id = new_tag_ids[new_tag_name]
+                if existing_relation:
+                    # Keep highest non-zero score if merging
+                    new_score = max(
+                        existing_relation.relation_value,
+                        relation.relation_value
+                    )
+                    if new_score > 0.0:
+                        existing_relation.relation_value = new_score
                     else:
-                        # Remove zero-score relation
-                        session.delete(relation)
+                        # If both scores are zero, remove the relation
+                        session.delete(existing_relation)
+                        existing_pairs.discard(key)
+                    session.delete(relation)
+                elif relation.relation_value > 0.0:
+                    # Only update if score is not zero
+                    relation.tag_id = new_tag_ids[new_tag_name]
+                    existing_pairs.add(key)
+                else:
+                    # Remove zero-score relation
+                    session.delete(relation)
 
 
 def cleanup_unused_tags(session: Session, dry_run: bool = False) -> None:
     """Remove tags that have no relations."""
-    # Find tags with no relations
-    unused_tags = (
-        session.query(ItemTag)
-        .outerjoin(ItemTagRelation)
-        .filter(ItemTagRelation.tag_id.is_(None))
-        .all()
-    )
+    # Tags with no relations
+    unused = ~exists().where(ItemTagRelation.tag_id == ItemTag.id)
+
+    if dry_run:
+        for tag_name in session.execute(select(ItemTag.name).where(unused)).scalars():
+            logger.info(f"Would remove unused tag: {tag_name}")
+        return
 
-    # Delete unused tags
-    for tag in unused_tags:
-        msg = f"Removing unused tag: {tag.name}"
-        logger.info(f"{'Would ' if dry_run else ''}{msg}")
-        if not dry_run:
-            session.delete(tag)
+    # Delete unused tags in a single statement
+    removed = session.execute(
+        delete(ItemTag).where(unused).returning(ItemTag.name)
+    ).scalars().all()
+    for tag_name in removed:
+        logger.info(f"Removing unused tag: {tag_name}")
 
 
 async def analyze_story_tags(processor: GenAIProcessor, session: Session, dry_run: bool = False) -> None:
     """Analyze tags generated by story summaries and suggest improvements."""
-    from octopus.scripts.generate_story_summaries import process_story_content
-
-    # Get all processed items with their tags
-    items = (
-        session.query(ProcessedItem)
-        .join(ItemTagRelation)
-        .join(ItemTag)
-        .filter(ProcessedItem.related_item_type == "hacker_news_story")
-        .all()
+    from octopus.scripts.generate_story_summaries import processor as story_processor
+
+    # Stream processed stories that have tags, each once, with the text of their live comments
+    stmt = (
+        select(Story)
+        .join(
+            ProcessedItem,
+            (ProcessedItem.related_item_type == "hacker_news_story") &
+            (ProcessedItem.related_item_id == Story.id)
+        )
+        .where(exists().where(ItemTagRelation.item_id == ProcessedItem.id))
+        .options(
+            selectinload(Story.comments.and_(StoryComment.deleted.is_(False)))
+            .load_only(StoryComment.content)
+        )
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
     )
 
-    logger.info(f"Analyzing tags for {len(items)} processed items...")
+    logger.info("Analyzing tags for processed items...")
 
     # Track all unique tags suggested by LLM
     suggested_tags = set()
+    item_count = 0
 
-    for item in items:
-        story = session.query(Story).filter(Story.id == item.related_item_id).first()
-        if not story:
-            continue
+    for stories in session.execute(stmt).scalars().partitions():
+        item_count += len(stories)
 
-        # Process story content to get suggested tags
-        _, tags, _ = await process_story_content(
-            story.content,
-            story.target_content,
-            [comment.content for comment in story.comments if not comment.deleted]
-        )
+        # Process contents of the streamed chunk concurrently to get suggested tags
+        results = await story_processor.process_contents([
+            (
+                story.content,
+                story.target_content,
+                [comment.content for comment in story.comments]
+            )
+            for story in stories
+        ])
 
         # Add suggested tags to set
-        suggested_tags.update(tag_name.lower() for tag_name, _ in tags)
+        for result in results:
+            if result is None:
+                continue
+            _, tags, _ = result
+            suggested_tags.update(tag_name.lower() for tag_name, _ in tags)
 
+    logger.info(f"Analyzed tags for {item_count} processed items")
     logger.info(f"Found {len(suggested_tags)} unique suggested tags")
 
     # Get all existing tags
@@ -253,37 +310,20 @@ async def analyze_story_tags(processor: GenAIProcessor, session: Session, dry_ru
 
     # Create new tags if needed
     tag_name_to_id = {tag.name: tag.id for tag in existing_tags}
-    new_tag_ids = {}
 
     # Collect all unique new tag names
     all_new_tags = set()
     for new_tags in tag_mapping.values():
         all_new_tags.update(new_tag.lower() for new_tag in new_tags)
 
-    if dry_run:
-        # In dry-run mode, just show what would be created/updated
-        for new_name in all_new_tags:
-            if new_name not in tag_name_to_id:
-                logger.info(f"Would create new tag: {new_name}")
-            new_tag_ids[new_name] = -1  # Dummy ID for dry run
-    else:
-        # Actually create new tags
-        for new_name in all_new_tags:
-            if new_name not in tag_name_to_id:
-                new_tag = ItemTag(name=new_name)
-                session.add(new_tag)
-                session.flush()
-                new_tag_ids[new_name] = new_tag.id
-                logger.info(f"Created new tag: {new_name}")
-            else:
-                new_tag_ids[new_name] = tag_name_to_id[new_name]
+    new_tag_ids = create_new_tags(session, all_new_tags, tag_name_to_id, dry_run)
 
     # Update relations
     update_tag_relations(session, tag_mapping, tag_name_to_id, new_tag_ids, dry_run)
 
     if not dry_run:
         # Cleanup unused tags and commit changes
-        cleanup_unused_tags(session, dry_run=args.dry_run)
+        cleanup_unused_tags(session, dry_run=dry_run)
         session.commit()
 
     logger.info("Tag analysis and revision completed successfully")
@@ -323,30 +363,13 @@ async def main() -> None:
 
         # Create new tags if needed
         tag_name_to_id = {tag.name: tag.id for tag in tags}
-        new_tag_ids = {}
 
         # Collect all unique new tag names
         all_new_tags = set()
         for new_tags in tag_mapping.values():
             all_new_tags.update(new_tag.lower() for new_tag in new_tags)
 
-        if args.dry_run:
-            # In dry-run mode, just show what would be created/updated
-            for new_name in all_new_tags:
-                if new_name not in tag_name_to_id:
-                    logger.info(f"Would create new tag: {new_name}")
-                new_tag_ids[new_name] = -1  # Dummy ID for dry run
-        else:
-            # Actually create new tags
-            for new_name in all_new_tags:
-                if new_name not in tag_name_to_id:
-                    new_tag = ItemTag(name=new_name)
-                    session.add(new_tag)
-                    session.flush()
-                    new_tag_ids[new_name] = new_tag.id
-                    logger.info(f"Created new tag: {new_name}")
-                else:
-                    new_tag_ids[new_name] = tag_name_to_id[new_name]
+        new_tag_ids = create_new_tags(session, all_new_tags, tag_name_to_id, args.dry_run)
 
         # Update relations
         update_tag_relations(session, tag_mapping, tag_name_to_id, new_tag_ids, dry_run=args.dry_run)
@@ -2,12 +2,13 @@
 
 import logging
 import re
-import pytz
-from datetime import datetime as dtime
+from datetime import datetime as dtime, UTC
 from typing import List, Tuple
 import asyncio
+from collections import OrderedDict
 
-from sqlalchemy import select
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 
 from octopus.processing.story_processor import StoryProcessor, EmptySummaryResult
@@ -18,16 +19,26 @@ from octopus.db.models.summaries import (
 from octopus.db.models.url_content import URLContent
 from octopus.db.session import session_scope
 from octopus.processing.content_extractor import DiffBotExtractor
-from octopus.db.operations import get_or_create_tag, get_or_create_entity, ensure_required_tags
+from octopus.db.operations import get_or_create_tag_ids, load_tag_ids, save_processed_story
 
 logger = logging.getLogger(__name__)
 
 REQUIRED_TAGS = ["machine learning", "generative ai", "cybersecurity"]
 
+# Maximum number of DiffBot requests in flight
+MAX_CONCURRENT_EXTRACTIONS = 10
+
 # Initialize processors
 story_processor = StoryProcessor(required_tags=REQUIRED_TAGS)
 content_extractor = DiffBotExtractor()
 
+# Target content of recently seen URLs, shared across batches to skip repeated cache lookups
+MAX_CACHED_URL_CONTENTS = 10_000
+_url_content_cache: "OrderedDict[str, str]" = OrderedDict()
+
+# URL regex pattern, compiled once at import time
+_URL_RE = re.compile(r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+')
+
 
 def extract_urls(content: str) -> List[str]:
     """
@@ -39,9 +50,15 @@ def extract_urls(content: str) -> List[str]:
     Returns:
         List[str]: List of extracted URLs
     """
-    # URL regex pattern
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+'
-    return re.findall(url_pattern, content)
+    return _URL_RE.findall(content)
+
+
+def cache_url_content(url: str, content: str) -> None:
+    """Remember extracted content of a URL, evicting the least recently used entries."""
+    _url_content_cache[url] = content
+    _url_content_cache.move_to_end(url)
+    while len(_url_content_cache) > MAX_CACHED_URL_CONTENTS:
+        _url_content_cache.popitem(last=False)
 
 
 async def process_story_content(
@@ -72,17 +89,20 @@ async def process_telegram_stories(force_regenerate: bool = False) -> None:
     """
     with session_scope() as db:
         try:
-            # Ensure required tags exist
-            ensure_required_tags(db, REQUIRED_TAGS)
+            # Cache tag and entity IDs for the whole run, creating required tags up front
+            tag_ids = load_tag_ids(db)
+            get_or_create_tag_ids(db, REQUIRED_TAGS, tag_ids)
+            db.commit()
+            entity_ids = {}
             
             # Process stories in batches
             batch_size = 100
-            offset = 0
+            last_id = 0  # Keyset pagination: resume after the last story of the previous batch
             
             while True:
-                # Get batch of stories
+                # Get batch of stories with their processed items
                 stmt = (
-                    select(TelegramStory)
+                    select(TelegramStory, ProcessedItem)
                     .outerjoin(
                         ProcessedItem,
                         (ProcessedItem.related_item_type == "telegram_story") &
@@ -93,58 +113,75 @@ async def process_telegram_stories(force_regenerate: bool = False) -> None:
                 if not force_regenerate:
                     stmt = stmt.where(ProcessedItem.id.is_(None))
                     
-                stmt = stmt.limit(batch_size).offset(offset)
-                stories = db.execute(stmt).unique().scalars().all()
+                stmt = (
+                    stmt.where(TelegramStory.id > last_id)
+                    .order_by(TelegramStory.id)
+                    .limit(batch_size)
+                )
+                rows = db.execute(stmt).all()
                 
-                if not stories:
+                if not rows:
                     break
+
+                stories = [story for story, _ in rows]
+                now = dtime.now(UTC)
                 
-                # Process current batch
+                # Extract URLs if not already present
                 for story in stories:
-                    processed_item = db.execute(
-                        select(ProcessedItem).where(
-                            ProcessedItem.related_item_type == "telegram_story",
-                            ProcessedItem.related_item_id == story.id
-                        )
-                    ).scalar_one_or_none()
+                    if not story.urls:
+                        story.urls = extract_urls(story.content)
+                db.commit()
+
+                # Take content of URLs seen earlier in the run from the in-process cache
+                batch_urls = {url for story in stories for url in story.urls or []}
+                url_content_cache = {}
+                for url in batch_urls:
+                    if url in _url_content_cache:
+                        _url_content_cache.move_to_end(url)
+                        url_content_cache[url] = _url_content_cache[url]
+
+                # Check cached content of the remaining URLs of the batch at once
+                uncached_urls = batch_urls - url_content_cache.keys()
+                if uncached_urls:
+                    for url, content in db.execute(
+                        select(URLContent.url, URLContent.target_content)
+                        .where(URLContent.url.in_(uncached_urls))
+                    ).tuples():
+                        url_content_cache[url] = content
+                        if content:
+                            cache_url_content(url, content)
 
+                # Extract content of uncached URLs concurrently; failures are remembered for the batch
+                extracted = await content_extractor.extract_contents(
+                    [url for url in batch_urls if url not in url_content_cache],
+                    MAX_CONCURRENT_EXTRACTIONS
+                )
+                url_content_cache.update(extracted)
+                for url, content in extracted.items():
+                    if content:
+                        cache_url_content(url, content)
+                new_url_contents = [
+                    {
+                        "url": url,
+                        "target_content": content,
+                        "extracted_at": now,
+                        "last_checked_at": now
+                    }
+                    for url, content in extracted.items()
+                    if content
+                ]
+
+                # Process story contents of the current batch
+                processed = []
+                for story, processed_item in rows:
                     if processed_item and not force_regenerate:
                         continue
 
-                    # Extract URLs if not already present
-                    if not story.urls:
-                        urls = extract_urls(story.content)
-                        story.urls = urls
-                        db.commit()
-
-                    # Get or extract content from URLs
-                    url_contents = []
-                    if story.urls:
-                        now = pytz.utc.localize(dtime.now())
-                        for url in story.urls:
-                            # Check if we have cached content
-                            url_content = db.execute(
-                                select(URLContent).where(URLContent.url == url)
-                            ).scalar_one_or_none()
-
-                            if url_content:
-                                if url_content.target_content:
-                                    url_contents.append(url_content.target_content)
-                                continue
-
-                            # Extract content if not cached
-                            content = content_extractor.extract_content(url)
-                            if content:
-                                url_contents.append(content)
-                                # Cache the content
-                                url_content = URLContent(
-                                    url=url,
-                                    target_content=content,
-                                    extracted_at=now,
-                                    last_checked_at=now
-                                )
-                                db.add(url_content)
-                                db.flush()
+                    # Get content of the story's URLs
+                    url_contents = [
+                        url_content_cache[url] for url in story.urls or []
+                        if url_content_cache[url]
+                    ]
 
                     # Process story content
                     try:
@@ -153,71 +190,70 @@ async def process_telegram_stories(force_regenerate: bool = False) -> None:
                     except EmptySummaryResult:
                         logger.warning(f"Failed to process story {story.id}")
                         continue
-                    
-                    # Get existing or create new processed item
-                    if force_regenerate:
-                        if processed_item:
-                            # Delete existing relations
+                    processed.append((story, processed_item, summary, tags, entities))
+
+                # Delete existing relations of regenerated items with one statement per table;
+                # if that fails, each story replaces its own relations instead
+                regenerated_item_ids = [item.id for _, item, _, _, _ in processed if item]
+                relations_deleted = False
+                if regenerated_item_ids:
+                    try:
+                        with db.begin_nested():
                             db.execute(
-                                ItemTagRelation.__table__.delete().where(
-                                    ItemTagRelation.item_id == processed_item.id
-                                )
+                                delete(ItemTagRelation)
+                                .where(ItemTagRelation.item_id.in_(regenerated_item_ids))
                             )
                             db.execute(
-                                ItemEntityRelation.__table__.delete().where(
-                                    ItemEntityRelation.item_id == processed_item.id
-                                )
+                                delete(ItemEntityRelation)
+                                .where(ItemEntityRelation.item_id.in_(regenerated_item_ids))
                             )
-                            
-                            # Update existing item
-                            processed_item.created_at = pytz.utc.localize(dtime.now())
-                            processed_item.summary = summary
-                            db.flush()
-
-                    if not processed_item:
-                        processed_item = ProcessedItem(
-                            created_at=pytz.utc.localize(dtime.now()),
-                            summary=summary,
-                            related_item_type="telegram_story",
-                            related_item_id=story.id
-                        )
-                        db.add(processed_item)
-                        db.flush()  # To get processed_item.id
-
-                    # Create tag relations
-                    tag_dict = dict(tags)
-
-                    # Ensure required tags are included with at least 0.5 score
-                    for required_tag in REQUIRED_TAGS:
-                        if required_tag not in tag_dict:
-                            tag_dict[required_tag] = 0.0
-
-                    # Create tag relations
-                    for tag_name, score in tag_dict.items():
-                        tag = get_or_create_tag(db, tag_name)
-                        relation = ItemTagRelation(
-                            item_id=processed_item.id,
-                            tag_id=tag.id,
-                            relation_value=score
-                        )
-                        db.add(relation)
-
-                    # Create entity relations
-                    for name, entity_type, score, context in entities:
-                        entity = get_or_create_entity(db, name, entity_type)
-                        relation = ItemEntityRelation(
-                            item_id=processed_item.id,
-                            entity_id=entity.id,
-                            relation_value=score,
-                            context=context
-                        )
-                        db.add(relation)
+                        relations_deleted = True
+                    except (SQLAlchemyError, DBAPIError) as e:
+                        logger.error(f"Failed to delete relations of regenerated items: {str(e)}")
+
+                for story, processed_item, summary, tags, entities in processed:
+                    # Create tag relations, including required tags with a default score
+                    tag_dict = dict.fromkeys(REQUIRED_TAGS, 0.0)
+                    tag_dict.update(tags)
+
+                    # Resolve tag and entity IDs and save the story in its own savepoint
+                    processed_item = save_processed_story(
+                        db,
+                        "telegram_story",
+                        story.id,
+                        processed_item,
+                        summary,
+                        tag_dict,
+                        entities,
+                        tag_ids,
+                        entity_ids,
+                        now,
+                        replace_relations=not relations_deleted
+                    )
+                    if processed_item is None:
+                        continue
 
                     logger.info(f"Processed Telegram story {story.id}")
-                    db.commit()
-                
+
+                # Cache newly extracted content of the whole batch at once; losing it
+                # only means extracting again later, so it doesn't abort the batch
+                if new_url_contents:
+                    try:
+                        with db.begin_nested():
+                            db.execute(
+                                pg_insert(URLContent).on_conflict_do_nothing(
+                                    index_elements=[URLContent.url]
+                                ),
+                                new_url_contents
+                            )
+                    except (SQLAlchemyError, DBAPIError) as e:
+                        logger.error(f"Failed to cache URL contents: {str(e)}")
+
+                # Commit the whole batch at once
+                db.commit()
+
                 # Move to next batch
-                offset += batch_size
+                last_id = stories[-1].id
                 
         except (SQLAlchemyError, DBAPIError) as e:
             logger.error(f"Database error in main processing loop: {str(e)}")
@@ -32,6 +32,10 @@ class Settings(BaseSettings):
     # DiffBot API settings
     diffbot_api_key: str
 
+    # Development settings
+    # Raise on relationship access that was not eager-loaded instead of lazy-loading it
+    strict_eager_loading: bool = False
+
     model_config = {
         "env_file": ".env",
         "extra": "allow"